@@ -0,0 +1,202 @@
+# analytics.py
+"""Агрегаты страниц дашборда без Streamlit: общие для UI и пакетных отчётов."""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from clusters import Clusters, MinHashIndex, find
+from cube import Cube
+from detect import TOP_K, DetectConfig, id_links, profile_links, suspicious
+from groups import GroupMatrix
+from helpers import counts_df, vc_df
+
+DEVICE_NAMES = {
+    "vk.com": "WEB", "m.vk.com": "WEB Mobile",
+    "Android app": "Android app", "iPhone app": "IOS app"
+}
+
+
+def top_mode(counts: pd.Series):
+    """Same pick as Series.mode()[0]: the smallest of the most frequent values."""
+    counts = counts[counts.index.notna()]
+    if counts.empty:
+        return "—"
+    return sorted(counts[counts == counts.max()].index)[0]
+
+
+# ─────────────────────────  1. Обзор  ──────────────────────────
+def overview_metrics(view: Cube) -> dict:
+    total = view.total()
+    bots = view.counts("Тип аккаунта").get("бот", 0)
+    return {"total": total,
+            "bot_share": bots / total if total else float("nan"),
+            "age_mean": view.age_mean(),
+            "top_segment": top_mode(view.counts("segment")),
+            "median": view.quantile(0.5)}
+
+
+def segment_sizes(view: Cube, top: int | None = None) -> pd.DataFrame:
+    return counts_df(view.counts("segment"), top=top, x_name="segment", y_name="Количество")
+
+
+def gender_counts(view: Cube) -> pd.DataFrame:
+    return counts_df(view.counts("Пол"), x_name="Пол", y_name="Количество")
+
+
+def age_counts(view: Cube) -> pd.DataFrame:
+    return counts_df(view.counts("Лет"), x_name="Лет", y_name="count")
+
+
+def city_counts(data: pd.DataFrame) -> pd.Series:
+    return data["РОДНОЙ ГОРОД"].str.lower().fillna("Неизвестно").value_counts(dropna=False)
+
+
+def cities_table(counts: pd.Series, top: int = 10) -> pd.DataFrame:
+    cities = counts_df(counts, top=top, x_name="ГородLower", y_name="Количество")
+    cities["Город"] = cities["ГородLower"].str.title()
+    return cities.sort_values("Количество", ascending=False)
+
+
+def top_cities(data: pd.DataFrame, top: int = 10) -> pd.DataFrame:
+    return cities_table(city_counts(data), top)
+
+
+def top_values(data: pd.DataFrame, col: str, name: str, top: int = 5) -> pd.DataFrame:
+    return vc_df(data[col], top=top, x_name=name, y_name="Количество")
+
+
+OVERVIEW_VALUES = {"ИМЯ": "Имя", "ФАМИЛИЯ": "Фамилия"}
+
+
+def overview_counts(data: pd.DataFrame) -> dict[str, pd.Series]:
+    """Value counts behind the Обзор tables, summable across row chunks."""
+    counts = {"cities": city_counts(data)}
+    for col in OVERVIEW_VALUES:
+        vc = data[col].value_counts(dropna=False)
+        counts[col] = vc[vc > 0].set_axis(vc.index[vc > 0].astype(object))
+    return counts
+
+
+def add_counts(a: dict[str, pd.Series], b: dict[str, pd.Series]) -> dict[str, pd.Series]:
+    """Counts of two row sets, sorted like ``value_counts``."""
+    return {k: a[k].add(b[k], fill_value=0).astype("int64")
+                   .sort_values(ascending=False, kind="stable") for k in a}
+
+
+# ─────────────────────────  2. Интересы  ──────────────────────────
+def segment_gender(data: pd.DataFrame) -> pd.DataFrame:
+    return data.groupby(["segment", "Пол"], observed=True)["VK ID"].count()\
+               .reset_index(name="count")
+
+
+def bot_share(data: pd.DataFrame) -> pd.DataFrame:
+    share = data.groupby(["segment", "Тип аккаунта"], observed=True)["VK ID"].count()\
+                .unstack(fill_value=0)
+    return share.div(share.sum(axis=1), axis=0)\
+                .reset_index()\
+                .melt(id_vars="segment", var_name="Тип аккаунта", value_name="Доля")
+
+
+def group_counts(gm: GroupMatrix, rows: np.ndarray | None = None) -> pd.DataFrame:
+    return gm.counts(rows).sort_values(["Количество", "Группа"], ascending=[False, True])
+
+
+# ─────────────────────────  3. Активность  ──────────────────────────
+def activity_metrics(view: Cube) -> dict:
+    p95 = view.quantile(0.95)
+    return {"mean": view.mean(), "median": view.quantile(0.5), "p95": p95,
+            "extreme_share": view.share_above(p95)}
+
+
+def segment_medians(view: Cube, top: int = 10) -> pd.DataFrame:
+    return view.quantile(0.5, by="segment")\
+               .reset_index(name="Медиана")\
+               .sort_values("Медиана", ascending=False).head(top)
+
+
+def median_heatmap(view: Cube) -> pd.DataFrame:
+    return view.quantile(0.5, by=["segment", "Тип аккаунта"])\
+               .unstack().fillna(0).sort_index().sort_index(axis=1)
+
+
+def device_counts(view: Cube) -> pd.DataFrame:
+    raw = view.counts("Устройство визита в VK")
+    names = raw.index.to_series().map(DEVICE_NAMES).fillna(raw.index.to_series())
+    return counts_df(raw.groupby(names.to_numpy(), dropna=False).sum()
+                        .sort_values(ascending=False, kind="stable"),
+                     x_name="device", y_name="count")
+
+
+def suspicious_users(data: pd.DataFrame, view: Cube, cfg: DetectConfig = DetectConfig(),
+                     k: int | None = TOP_K) -> pd.DataFrame:
+    sus = suspicious(data, view, cfg, k)[["VK ID", "ИМЯ", "ФАМИЛИЯ", "group_count"]]
+    sus["Профиль"] = profile_links(sus)
+    return sus.rename(columns={"group_count": "Подписки"})
+
+
+# ─────────────────────────  4. Боты  ──────────────────────────
+def bot_view(view: Cube) -> Cube:
+    return view.slice({"Тип аккаунта": ["бот"]})
+
+
+def bot_rows(data: pd.DataFrame) -> pd.DataFrame:
+    return data[data["Тип аккаунта"] == "бот"]
+
+
+def bot_metrics(view: Cube) -> dict:
+    bots = bot_view(view)
+    n_bots, total = bots.total(), view.total()
+    return {"bots": n_bots,
+            "bot_share": n_bots / total if total else float("nan"),
+            "median": bots.quantile(0.5)}
+
+
+def suspicious_bots(data: pd.DataFrame, view: Cube, cfg: DetectConfig = DetectConfig(),
+                    k: int | None = TOP_K) -> pd.DataFrame:
+    susb = suspicious(bot_rows(data), view, cfg, k)[["VK ID", "segment", "group_count"]]
+    susb["Ссылка"] = id_links(susb)
+    return susb.rename(columns={"group_count": "Подписки"})
+
+
+def bot_clusters(data: pd.DataFrame, gm: GroupMatrix, lsh: MinHashIndex | None = None,
+                 rows: np.ndarray | None = None) -> Clusters:
+    return find(data, gm, lsh if lsh is not None else MinHashIndex.build(gm), rows)
+
+
+# ─────────────────────────  Отчёт целиком  ──────────────────────────
+def report(data: pd.DataFrame, view: Cube, gm: GroupMatrix | None,
+           cfg: DetectConfig = DetectConfig(), k: int | None = TOP_K) -> dict:
+    """Every page's aggregates for one (already filtered) dataset."""
+    bots = bot_view(view)
+    return {
+        "overview": {
+            "metrics": overview_metrics(view),
+            "top_segments": segment_sizes(view, top=5),
+            "gender": gender_counts(view),
+            "ages": age_counts(view),
+            "cities": top_cities(data),
+            "names": top_values(data, "ИМЯ", "Имя"),
+            "surnames": top_values(data, "ФАМИЛИЯ", "Фамилия"),
+        },
+        "interests": {
+            "segments": segment_sizes(view),
+            "segment_gender": segment_gender(data),
+            "bot_share": bot_share(data),
+            "groups": group_counts(gm) if gm is not None else None,
+        },
+        "activity": {
+            "metrics": activity_metrics(view),
+            "segment_medians": segment_medians(view),
+            "median_heatmap": median_heatmap(view),
+            "devices": device_counts(view),
+            "suspicious": suspicious_users(data, view, cfg, k),
+        },
+        "bots": {
+            "metrics": bot_metrics(view),
+            "gender": gender_counts(bots),
+            "cities": top_cities(bot_rows(data)),
+            "suspicious": suspicious_bots(data, view, cfg, k),
+            "clusters": bot_clusters(data, gm).table if gm is not None else None,
+        },
+    }
@@ -0,0 +1,154 @@
+# batch.py
+"""Пакетные отчёты без Streamlit.
+
+    python batch.py EXPORTS_DIR [-o reports] [-j N]
+
+Каждый .csv/.xlsx из EXPORTS_DIR проходит ту же загрузку и проверки, что
+и в дашборде, а агрегаты всех страниц сохраняются в <файл>.json и
+<файл>.html (например, export.csv.json). Файлы обрабатываются параллельно в пуле процессов.
+"""
+from __future__ import annotations
+
+import argparse
+import html
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import analytics as an
+import charts
+from cube import Cube
+from groups import GroupMatrix
+from ingest import CACHE_DIR, REQ, load_path
+
+PATTERNS = ("*.csv", "*.xlsx")
+HTML_ROWS = 100  # rows of long tables shown in the HTML report
+
+
+def jsonable(obj):
+    """Aggregates → plain JSON types (frames as records, NaN as null)."""
+    if isinstance(obj, dict):
+        return {str(k): jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, pd.DataFrame):
+        if not isinstance(obj.index, pd.RangeIndex):
+            obj = obj.reset_index()
+        return [jsonable(r) for r in obj.astype(object).to_dict("records")]
+    if isinstance(obj, pd.Series):
+        return jsonable(obj.to_dict())
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float) and not math.isfinite(obj):
+        return None
+    if obj is pd.NA or obj is pd.NaT:
+        return None
+    return obj
+
+
+def figures(rep: dict, data: pd.DataFrame) -> list[tuple[str, object]]:
+    ov, it, ac, bt = rep["overview"], rep["interests"], rep["activity"], rep["bots"]
+    figs = [
+        ("⭐ TOP-5 сегментов", charts.top_segments_fig(ov["top_segments"])),
+        ("🧑‍🤝‍🧑 Пол", charts.gender_fig(ov["gender"])),
+        ("📊 Гистограмма возраста", charts.age_fig(ov["ages"])),
+        ("🏙️ ТОП-10 городов", charts.cities_fig(ov["cities"])),
+        ("📊 Размер сегментов", charts.segment_sizes_fig(it["segments"])),
+        ("🧑‍🤝‍🧑 Распределение сегментов по полу", charts.segment_gender_fig(it["segment_gender"])),
+        ("🤖 Доля ботов внутри сегмента", charts.bot_share_fig(it["bot_share"])),
+    ]
+    if it["groups"] is not None:
+        figs.append(("🌳 Карта групп", charts.treemap_fig(it["groups"])))
+    figs += [
+        ("🏅 Медиана подписок по сегментам (TOP-10)", charts.segment_medians_fig(ac["segment_medians"])),
+        ("🌡️ Медиана подписок: сегмент × тип аккаунта", charts.median_heatmap_fig(ac["median_heatmap"])),
+        ("📱 Устройства визита в VK", charts.devices_fig(ac["devices"])),
+        ("🔍 Подписки vs Возраст", charts.age_subs_scatter(data)),
+        ("📊 Доля экстремально активных (>P95)",
+         charts.extreme_gauge_fig(ac["metrics"]["extreme_share"] * 100)),
+        ("👨‍👩‍👧‍👦 Пол ботов", charts.gender_fig(bt["gender"])),
+        ("🏙️ ТОП-10 городов (боты)", charts.cities_fig(bt["cities"], color=charts.COL_BOTS_CITY)),
+    ]
+    return figs
+
+
+def render_html(title: str, rep: dict, figs) -> str:
+    parts = [f"<h1>{html.escape(title)}</h1>"]
+    for page, sections in jsonable({k: v for k, v in rep.items()}).items():
+        parts.append(f"<h2>{html.escape(page)}</h2>")
+        metrics = sections.get("metrics") or {}
+        parts.append("<table>" + "".join(
+            f"<tr><th>{html.escape(k)}</th><td>{html.escape(str(v))}</td></tr>"
+            for k, v in metrics.items()) + "</table>")
+    for i, (caption, fig) in enumerate(figs):
+        parts.append(f"<h3>{html.escape(caption)}</h3>")
+        parts.append(fig.to_html(full_html=False, include_plotlyjs="cdn" if i == 0 else False))
+    for page, name in [("activity", "suspicious"), ("bots", "suspicious"),
+                       ("bots", "clusters"), ("interests", "groups")]:
+        table = rep[page][name]
+        if table is not None:
+            parts.append(f"<h3>{page} / {name} (первые {HTML_ROWS})</h3>")
+            parts.append(table.head(HTML_ROWS).to_html(index=False, na_rep=""))
+    return ("<!doctype html><html><head><meta charset='utf-8'>"
+            f"<title>{html.escape(title)}</title></head><body>"
+            + "\n".join(parts) + "</body></html>")
+
+
+def process(path: Path, out_dir: Path, cache_dir: Path = CACHE_DIR) -> dict:
+    """Build the JSON and HTML report for one export; never raises."""
+    started = time.perf_counter()
+    result = {"file": path.name}
+    try:
+        df, missing = load_path(path, cache_dir=cache_dir)
+        missing = missing or sorted(REQ - set(df.columns))
+        if missing:
+            result.update(status="error", error="Отсутствуют колонки: " + ", ".join(missing))
+            return result
+        rep = an.report(df, Cube.build(df), GroupMatrix.build(df))
+        base = out_dir / path.name  # a.csv and a.xlsx must not overwrite each other
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump({"file": path.name, "rows": len(df), "dataset_key": df.attrs["dataset_key"],
+                       **jsonable(rep)}, f, ensure_ascii=False, indent=1)
+        Path(f"{base}.html").write_text(render_html(path.name, rep, figures(rep, df)),
+                                        encoding="utf-8")
+        result.update(status="ok", rows=len(df))
+    except Exception as e:
+        result.update(status="error", error=f"{type(e).__name__}: {e}")
+    finally:
+        result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Пакетные отчёты Segment Viewer")
+    ap.add_argument("exports", type=Path, help="папка с .csv/.xlsx выгрузками")
+    ap.add_argument("-o", "--out", type=Path, default=Path("reports"), help="куда писать отчёты")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="число процессов")
+    ap.add_argument("--cache-dir", type=Path, default=CACHE_DIR, help="кеш Parquet")
+    args = ap.parse_args(argv)
+
+    files = sorted(p for pat in PATTERNS for p in args.exports.glob(pat))
+    if not files:
+        print(f"В {args.exports} нет .csv/.xlsx файлов", file=sys.stderr)
+        return 1
+    args.out.mkdir(parents=True, exist_ok=True)
+    results = []
+    with ProcessPoolExecutor(max_workers=max(1, min(args.jobs, len(files)))) as pool:
+        futures = [pool.submit(process, p, args.out, args.cache_dir) for p in files]
+        for fut in as_completed(futures):
+            res = fut.result()
+            results.append(res)
+            print(f"[{res['status']}] {res['file']} {res.get('seconds', 0)}s {res.get('error', '')}")
+    results.sort(key=lambda r: r["file"])
+    (args.out / "index.json").write_text(json.dumps(results, ensure_ascii=False, indent=1),
+                                         encoding="utf-8")
+    return int(any(r["status"] != "ok" for r in results))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+# bench.py
+"""Бенчмарк масштабирования: время и пик памяти каждого этапа дашборда.
+
+    python bench.py [--sizes 10k,1m,10m] [--formats csv,xlsx] [-o benchmarks/baseline.json]
+    python bench.py --sizes 10k --compare benchmarks/baseline.json
+    python bench.py --check
+
+Входные файлы генерирует synth.py (кешируются в benchmarks/data/). Для
+каждого размера и формата замеряются чтение и переименование колонок,
+кеш Parquet, индексы фильтров, маска фильтра, vc_df и агрегаты каждой
+страницы. Результат — JSON, пригодный как базовая линия для сравнения.
+``--check`` сверяет ответы куба с pandas на выгрузке с пустыми ключами,
+строит по ней пакетный отчёт и сравнивает структуры, обновлённые при
+дозагрузке, с построенными заново.
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import analytics as an
+import batch
+import synth
+from cube import DIMS, GAMMA, Cube
+from export import XLSX_MAX_ROWS
+from filter_index import FILTER_COLS, FilterIndex
+from clusters import MinHashIndex
+from groups import GroupMatrix
+from helpers import vc_df
+from ingest import _concat, _parse, _store, is_group_col
+from merge import ID, RULES, append
+from store import DatasetStore
+
+BENCH_DIR = Path(__file__).with_name("benchmarks")
+DATA_DIR = BENCH_DIR / "data"
+SUFFIXES = {"k": 1_000, "m": 1_000_000}
+CHECK_ROWS = 10_000
+CHECK_BLANKS = 0.02  # share of blank segment / Тип аккаунта cells in the check export
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().lower()
+    if text[-1:] in SUFFIXES:
+        return int(float(text[:-1]) * SUFFIXES[text[-1]])
+    return int(text)
+
+
+def measure(fn, repeat: int = 1, memory: bool = True) -> tuple[object, dict]:
+    """Best wall time of ``repeat`` runs, plus the tracemalloc peak of one more run."""
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    out = {"seconds": round(min(times), 6)}
+    if memory:
+        del result
+        gc.collect()
+        tracemalloc.start()
+        try:
+            result = fn()
+            out["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 3)
+        finally:
+            tracemalloc.stop()
+    return result, out
+
+
+def dataset(fmt: str, n: int, groups: int, seed: int, blanks: float = 0.0) -> Path:
+    suffix = f"_b{blanks:g}" if blanks else ""
+    path = DATA_DIR / f"synth_{n}_g{groups}_s{seed}{suffix}.{fmt}"
+    if not path.exists():
+        print(f"  генерация {path.name}…", flush=True)
+        tmp = path.with_name(f"tmp_{path.name}")
+        synth.WRITERS[f".{fmt}"](tmp, n, groups=groups, seed=seed, blanks=blanks)
+        os.replace(tmp, path)
+    return path
+
+
+def typical_filter(df: pd.DataFrame) -> tuple[dict, tuple]:
+    """Three biggest segments, all account types and genders, ages 18–45."""
+    segs = df["segment"].value_counts().index[:3].tolist()
+    sel = {"segment": segs,
+           "Тип аккаунта": df["Тип аккаунта"].dropna().unique().tolist(),
+           "Пол": df["Пол"].dropna().unique().tolist()}
+    return sel, (18.0, 45.0)
+
+
+def run_case(path: Path, repeat: int, memory: bool) -> dict:
+    stages = {}
+
+    def stage(name, fn):
+        result, stats = measure(fn, repeat, memory)
+        stages[name] = stats
+        print(f"  {name:<22} {stats['seconds']:>9.3f} s"
+              + (f" {stats['peak_mb']:>10.1f} МБ" if "peak_mb" in stats else ""), flush=True)
+        return result
+
+    def read():
+        with open(path, "rb") as f:
+            return _parse(f, path.name, None)
+
+    df, missing = stage("read_canon", read)
+    if missing:
+        raise ValueError(f"{path.name}: нет колонок {missing}")
+    cache = path.with_suffix(".bench.parquet")
+    stage("cache_write", lambda: _store(df, cache))
+    stage("cache_read", lambda: pd.read_parquet(cache, memory_map=True))
+    cache.unlink(missing_ok=True)
+
+    fi = stage("filter_index", lambda: FilterIndex(df))
+    cube = stage("cube_build", lambda: Cube.build(df))
+    gm = stage("groups_build", lambda: GroupMatrix.build(df))
+    lsh = stage("minhash_build", lambda: MinHashIndex.build(gm)) if gm is not None else None
+    sel, ages = typical_filter(df)
+    mask = stage("filter_mask", lambda: _fresh_mask(fi, sel, ages))
+    data = stage("filter_rows", lambda: df[mask])
+    view = stage("cube_slice", lambda: cube.slice(sel, ages))
+
+    stage("vc_df_city", lambda: vc_df(data["РОДНОЙ ГОРОД"], top=10))
+    stage("vc_df_segment", lambda: vc_df(data["segment"]))
+    stage("page_overview", lambda: (an.overview_metrics(view), an.segment_sizes(view, top=5),
+                                    an.gender_counts(view), an.age_counts(view),
+                                    an.top_cities(data), an.top_values(data, "ИМЯ", "Имя"),
+                                    an.top_values(data, "ФАМИЛИЯ", "Фамилия")))
+    stage("page_interests", lambda: (an.segment_sizes(view), an.segment_gender(data),
+                                     an.bot_share(data),
+                                     an.group_counts(gm, mask) if gm is not None else None))
+    stage("page_activity", lambda: (an.activity_metrics(view), an.segment_medians(view),
+                                    an.median_heatmap(view), an.device_counts(view),
+                                    an.suspicious_users(data, view)))
+    stage("page_bots", lambda: (an.bot_metrics(view), an.gender_counts(an.bot_view(view)),
+                                an.top_cities(an.bot_rows(data)),
+                                an.suspicious_bots(data, view)))
+    if gm is not None:
+        stage("bot_clusters", lambda: an.bot_clusters(df, gm, lsh, mask))
+    return {"rows": len(df), "file_mb": round(path.stat().st_size / 2**20, 3),
+            "frame_mb": round(df.memory_usage(deep=True).sum() / 2**20, 3), "stages": stages}
+
+
+def _fresh_mask(fi: FilterIndex, sel: dict, ages) -> np.ndarray:
+    """Mask with the memo bypassed so every run does the real work."""
+    fi._memo.clear()
+    return fi.mask(sel, ages)
+
+
+def _mismatch(name: str, got: pd.Series, exp: pd.Series, rtol: float) -> list[str]:
+    got = got.reindex(exp.index)
+    if len(got) == len(exp) and np.allclose(got, exp, rtol=rtol, equal_nan=True):
+        return []
+    return [f"{name}: куб {got.round(3).tolist()[:5]} ≠ pandas {exp.round(3).tolist()[:5]}"]
+
+
+def check(groups: int = 5, seed: int = 0) -> list[str]:
+    """Cube medians vs pandas (groupby/pivot_table) on an export with blank keys,
+    plus a batch report of that export."""
+    path = dataset("csv", CHECK_ROWS, groups, seed, blanks=CHECK_BLANKS)
+    with open(path, "rb") as f:
+        df, _ = _parse(f, path.name, None)
+    view = Cube.build(df)
+    rtol = 1e-9 if view.exact else GAMMA - 1  # log buckets are within one bucket width
+    gc = df["group_count"].astype("float64")
+    failures = _mismatch("segment_medians",
+                         an.segment_medians(view, top=None).set_index("segment")["Медиана"],
+                         gc.groupby(df["segment"], observed=True).median(), rtol)
+    heat = an.median_heatmap(view)
+    ref = df.assign(group_count=gc).pivot_table(index="segment", columns="Тип аккаунта",
+                                               values="group_count", aggfunc="median",
+                                               observed=True).fillna(0)
+    failures += _mismatch("median_heatmap", heat.stack(), ref.stack(), rtol)
+    with tempfile.TemporaryDirectory() as tmp:
+        res = batch.process(path, Path(tmp), cache_dir=Path(tmp))
+    if res["status"] != "ok":
+        failures.append(f"batch {path.name}: {res.get('error')}")
+    for rule in RULES:
+        failures += merge_check(df, rule, rtol)
+    return failures
+
+
+def merge_check(df: pd.DataFrame, rule: str, rtol: float) -> list[str]:
+    """Structures updated by ``merge.append`` vs the same ones rebuilt from the merged frame.
+
+    The base repeats some VK IDs and the appended part overlaps it with
+    changed group counts, so both dedup paths and the rule are exercised;
+    the base ends with rows without groups.
+    """
+    n = len(df)
+    base = _concat([df.iloc[:n * 7 // 10].copy(), df.iloc[:n // 50].copy()])
+    base.loc[len(base) - 3:, [c for c in base.columns if is_group_col(c)]] = None
+    add = df.iloc[n // 2:].reset_index(drop=True)
+    add = add.assign(group_count=add["group_count"].astype("float64") + 1)
+    base.attrs["dataset_key"], add.attrs["dataset_key"] = "check_base", "check_add"
+    with tempfile.TemporaryDirectory() as tmp:
+        store = DatasetStore(cache_dir=Path(tmp))
+        handle = store.put(base)
+        gm = store.derived(handle.key, "groups", GroupMatrix.build)
+        for name, build in [("index", FilterIndex), ("cube", Cube.build),
+                            ("minhash", lambda _: MinHashIndex.build(gm))]:
+            store.derived(handle.key, name, build)
+        merged = append(store, handle.key, [add], rule)
+        out, built = merged.df, store.built(merged.key)
+
+    tag = f"merge {rule}"
+    both = pd.concat([base, add], ignore_index=True)
+    dup = both[ID].duplicated(keep="last" if rule == "newest" else "first") & both[ID].notna()
+    ref = both[~dup.to_numpy()]
+    failures = []
+    for col in (ID, "group_count"):
+        if not np.array_equal(out[col].to_numpy(dtype="float64"),
+                              ref[col].to_numpy(dtype="float64"), equal_nan=True):
+            failures.append(f"{tag}: строки {col} ≠ drop_duplicates")
+
+    fi, exp = built["index"], FilterIndex(out)
+    for col in FILTER_COLS:
+        values = exp.values[col]
+        if sorted(map(str, fi.values[col])) != sorted(map(str, values)):
+            failures.append(f"{tag}: FilterIndex значения {col}")
+        elif any(not np.array_equal(fi.value_mask(col, v), exp.value_mask(col, v)) for v in values):
+            failures.append(f"{tag}: FilterIndex маски {col}")
+    everything = {col: exp.values[col] for col in FILTER_COLS}
+    for ages in (exp.age_bounds, (18.0, 45.0)):
+        if fi.age_bounds != exp.age_bounds or not np.array_equal(fi.mask(everything, ages),
+                                                                 exp.mask(everything, ages)):
+            failures.append(f"{tag}: FilterIndex возраст {ages}")
+
+    cube, exp = built["cube"], Cube.build(out)
+    for name, got, want in [("total", cube.total(), exp.total()), ("mean", cube.mean(), exp.mean()),
+                            ("std", cube.std(), exp.std()),
+                            ("median", cube.quantile(0.5), exp.quantile(0.5)),
+                            ("p95", cube.quantile(0.95), exp.quantile(0.95))]:
+        if not np.isclose(got, want, rtol=rtol, equal_nan=True):
+            failures.append(f"{tag}: Cube {name} {got} ≠ {want}")
+    for dim in DIMS:
+        failures += _mismatch(f"{tag}: Cube counts {dim}", cube.counts(dim).astype(float),
+                              exp.counts(dim).astype(float), 0)
+    failures += _mismatch(f"{tag}: Cube медианы", cube.quantile(0.5, by="segment"),
+                          exp.quantile(0.5, by="segment"), rtol)
+
+    gm, exp = built["groups"], GroupMatrix.build(out)
+    if not (np.array_equal(gm.indptr, exp.indptr)
+            and np.array_equal(gm.names[gm.indices], exp.names[exp.indices])):
+        failures.append(f"{tag}: GroupMatrix")
+    lsh, exp = built["minhash"], MinHashIndex.build(exp)
+    if not (np.array_equal(lsh.keys, exp.keys) and np.array_equal(lsh.sizes, exp.sizes)):
+        failures.append(f"{tag}: MinHash ключи {(lsh.keys != exp.keys).any(axis=1).sum()} строк")
+    return failures
+
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, cwd=Path(__file__).parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def meta() -> dict:
+    return {"created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": _git_rev(), "python": platform.python_version(),
+            "pandas": pd.__version__, "numpy": np.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def compare(results: dict, baseline: dict, tolerance: float,
+            min_seconds: float = 0.05) -> list[str]:
+    """Stages slower than ``tolerance`` × baseline, as readable lines.
+
+    Stages faster than ``min_seconds`` in both runs are timer noise and skipped.
+    """
+    base = {(c["format"], c["rows"]): c["stages"] for c in baseline["cases"] if "stages" in c}
+    slow = []
+    for case in results["cases"]:
+        old = base.get((case["format"], case["rows"]))
+        for name, stats in case.get("stages", {}).items():
+            ref = (old or {}).get(name)
+            if not ref or ref["seconds"] <= 0 or max(ref["seconds"], stats["seconds"]) < min_seconds:
+                continue
+            ratio = stats["seconds"] / ref["seconds"]
+            if ratio > tolerance:
+                slow.append(f"{case['format']} {case['rows']}: {name} "
+                            f"{ref['seconds']:.3f} → {stats['seconds']:.3f} s (×{ratio:.2f})")
+    return slow
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(description="Бенчмарк Segment Viewer")
+    ap.add_argument("--sizes", default="10k,1m,10m", help="число строк через запятую (10k, 1m…)")
+    ap.add_argument("--formats", default="csv,xlsx")
+    ap.add_argument("--groups", type=int, default=5, help="колонок group_*_name")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--repeat", type=int, default=1, help="прогонов на замер времени")
+    ap.add_argument("--no-memory", action="store_true", help="без tracemalloc")
+    ap.add_argument("-o", "--out", type=Path, help="куда сохранить JSON")
+    ap.add_argument("--compare", type=Path, help="базовая линия для сравнения")
+    ap.add_argument("--tolerance", type=float, default=1.5, help="допустимое замедление")
+    ap.add_argument("--min-seconds", type=float, default=0.05, help="короче — не сравнивать")
+    ap.add_argument("--check", action="store_true", help="только сверка с pandas")
+    args = ap.parse_args(argv)
+    if args.check:
+        failures = check(args.groups, args.seed)
+        for line in failures:
+            print("расхождение:", line)
+        print("сверка:", "ошибки" if failures else "ok")
+        return int(bool(failures))
+
+    results = {"meta": {**meta(), "groups": args.groups, "seed": args.seed,
+                        "repeat": args.repeat}, "cases": []}
+    for n in map(parse_size, args.sizes.split(",")):
+        for fmt in args.formats.split(","):
+            case = {"format": fmt, "rows": n}
+            print(f"{fmt} × {n:,}".replace(",", " "), flush=True)
+            if fmt == "xlsx" and n > XLSX_MAX_ROWS:
+                case["skipped"] = f"больше {XLSX_MAX_ROWS} строк"
+                print(f"  пропуск: {case['skipped']}")
+            else:
+                path = dataset(fmt, n, args.groups, args.seed)
+                case.update(run_case(path, args.repeat, not args.no_memory))
+            results["cases"].append(case)
+
+    if args.out:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(json.dumps(results, ensure_ascii=False, indent=1), encoding="utf-8")
+    if args.compare:
+        slow = compare(results, json.loads(args.compare.read_text(encoding="utf-8")),
+                       args.tolerance, args.min_seconds)
+        for line in slow:
+            print("медленнее:", line)
+        return int(bool(slow))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
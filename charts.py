@@ -0,0 +1,235 @@
+# charts.py
+"""Построение графиков дашборда из готовых агрегатов (без Streamlit)."""
+from __future__ import annotations
+
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+# ───────────────────────────  ЦВЕТОВЫЕ КОНСТАНТЫ  ───────────────────────
+COL_FEMALE     = "#FFB6C1"
+COL_MALE       = "#4682B4"
+COL_BOT        = "#7B9EA8"
+COL_USER       = "#A3C9A8"
+COL_SEGMENT    = "#C3B1E1"
+COL_CITY       = "#E4C7A8"
+COL_INTERESTS  = "#79C7C5"
+COL_MEDIAN     = "#E8A798"
+DEV_COLORS     = {
+    "WEB": "#B0C4DE",
+    "WEB Mobile": "#D1BAC4",
+    "IOS app": "#C1E1C1",
+    "Android app": "#C1DDE8"
+}
+COL_BOTS_CITY  = "#D1C4E9"
+GENDER_COLORS  = {"женский": COL_FEMALE, "мужской": COL_MALE}
+TYPE_COLORS    = {"бот": COL_BOT, "пользователь": COL_USER}
+
+# Row-count thresholds for the "Подписки vs Возраст" scatter
+SVG_MAX = int(os.environ.get("SEGMENT_VIEWER_SVG_POINTS", 5_000))
+GL_MAX = int(os.environ.get("SEGMENT_VIEWER_GL_POINTS", 100_000))
+SAMPLE_POINTS = int(os.environ.get("SEGMENT_VIEWER_SAMPLE_POINTS", 20_000))
+DENSITY_BINS = 60
+
+SCATTER_MODES = {"auto": "Авто", "density": "Плотность", "sample": "Выборка"}
+SCATTER_LABELS = {"Лет": "Возраст", "group_count": "Подписки"}
+
+
+def scatter_strategy(n: int, mode: str = "auto") -> str:
+    """Pick "svg", "webgl", "density" or "sample" for ``n`` points."""
+    if mode != "auto":
+        return mode
+    if n <= SVG_MAX:
+        return "svg"
+    if n <= GL_MAX:
+        return "webgl"
+    return "density"
+
+
+def stratified_sample(df: pd.DataFrame, by: str, size: int, seed: int = 0) -> pd.DataFrame:
+    """At most ``size`` rows, proportional per ``by`` value.
+
+    Every stratum keeps at least ``size // 20`` rows (less when there are
+    more than 20 strata); the proportional part shrinks so the floors never
+    push the total over ``size``.
+    """
+    if len(df) <= size:
+        return df
+    rng = np.random.default_rng(seed)
+    codes, _ = pd.factorize(df[by], use_na_sentinel=False)
+    counts = np.bincount(codes)
+    floor = np.minimum(counts, size // max(20, len(counts)))
+    quota = np.minimum(np.maximum(np.round(size * counts / len(df)), floor), counts)
+    extra = quota - floor
+    if quota.sum() > size:
+        quota = floor + np.floor(extra * (size - floor.sum()) / extra.sum())
+    quota = quota.astype(int)
+    keep = np.concatenate([
+        rng.choice(np.flatnonzero(codes == k), quota[k], replace=False)
+        for k in range(len(counts))
+    ])
+    return df.iloc[np.sort(keep)]
+
+
+def _density(df: pd.DataFrame, x: str, y: str, color: str, color_map: dict) -> go.Figure:
+    """Server-side 2D histogram, one heatmap panel per ``color`` value."""
+    xs = df[x].to_numpy(dtype=float)
+    ys = df[y].to_numpy(dtype=float)
+    x_edges = np.histogram_bin_edges(xs, bins=min(DENSITY_BINS, max(int(np.ptp(xs)) + 1, 1)))
+    y_edges = np.histogram_bin_edges(ys, bins=DENSITY_BINS)
+    x_mid = (x_edges[:-1] + x_edges[1:]) / 2
+    y_mid = (y_edges[:-1] + y_edges[1:]) / 2
+    groups = [g for g in pd.unique(df[color]) if pd.notna(g)]
+    fig = make_subplots(rows=1, cols=max(len(groups), 1), shared_yaxes=True,
+                        subplot_titles=[str(g) for g in groups])
+    codes = df[color].to_numpy()
+    for i, g in enumerate(groups, start=1):
+        sel = codes == g
+        z, _, _ = np.histogram2d(xs[sel], ys[sel], bins=[x_edges, y_edges])
+        z = z.T
+        fig.add_trace(go.Heatmap(
+            x=x_mid, y=y_mid, z=np.log10(z, out=np.full_like(z, np.nan), where=z > 0),
+            customdata=z,
+            colorscale=[[0, "#f4f6f8"], [1, color_map.get(g, "#4682B4")]],
+            showscale=False, name=str(g),
+            hovertemplate=f"{g}<br>{SCATTER_LABELS[x]}: %{{x:.0f}}<br>"
+                          f"{SCATTER_LABELS[y]}: %{{y:.0f}}<br>Количество: %{{customdata:,}}<extra></extra>",
+        ), row=1, col=i)
+        fig.update_xaxes(title_text=SCATTER_LABELS[x], row=1, col=i)
+    fig.update_yaxes(title_text=SCATTER_LABELS[y], row=1, col=1)
+    return fig
+
+
+def age_subs_scatter(data: pd.DataFrame, color_map: dict = TYPE_COLORS, mode: str = "auto",
+                     height: int = 380) -> go.Figure:
+    """"Подписки vs Возраст" with a payload bounded by GL_MAX points or the density grid."""
+    pts = data[["Лет", "group_count", "Тип аккаунта"]].dropna(subset=["Лет", "group_count"])
+    strategy = scatter_strategy(len(pts), mode)
+    if strategy == "density" and len(pts):
+        fig = _density(pts, "Лет", "group_count", "Тип аккаунта", color_map)
+        fig.update_layout(height=height, margin=dict(l=10, r=10, t=40, b=10))
+        return fig
+    if strategy == "sample":
+        pts = stratified_sample(pts, "Тип аккаунта", SAMPLE_POINTS)
+    elif len(pts) > GL_MAX:  # explicit modes still respect the cap
+        pts = stratified_sample(pts, "Тип аккаунта", GL_MAX)
+    return px.scatter(pts, x="Лет", y="group_count", color="Тип аккаунта",
+                      labels=SCATTER_LABELS, color_discrete_map=color_map, height=height,
+                      render_mode="svg" if strategy == "svg" else "webgl")
+
+
+# ─────────────────────────────  BUILDERS  ──────────────────────────────
+def bar_base(df: pd.DataFrame, x: str, y: str, **kw):
+    fig = px.bar(df, x=x, y=y, text_auto=".0s", height=380,
+                 labels={x: "", y: "Количество"}, **kw)
+    fig.update_layout(margin=dict(l=10, r=10, t=40, b=10))
+    fig.update_traces(hovertemplate=f"{x}: %{{x}}<br>Количество: %{{y:,}}")
+    return fig
+
+
+def top_segments_fig(top5: pd.DataFrame):
+    fig = px.bar(top5, x="segment", y="Количество", text="Количество",
+                 labels={"segment": "Сегмент"},
+                 color_discrete_sequence=[COL_SEGMENT], height=380)
+    fig.update_traces(textposition="inside")
+    return fig
+
+
+def gender_fig(counts: pd.DataFrame):
+    pie = px.pie(counts, names="Пол", values="Количество", hole=0.4, height=350,
+                 color_discrete_map=GENDER_COLORS)
+    pie.update_traces(textposition="inside", textinfo="percent+label")
+    return pie
+
+
+def age_fig(ages: pd.DataFrame):
+    hist = px.histogram(ages, x="Лет", y="count", histfunc="sum", nbins=10,
+                        labels={"Лет":"Возраст","count":"Количество"},
+                        height=350, color_discrete_sequence=[COL_MALE])
+    hist.update_layout(margin=dict(l=10, r=10, t=40, b=10))
+    hist.update_yaxes(title="Количество")
+    return hist
+
+
+def cities_fig(cities: pd.DataFrame, color: str = COL_CITY):
+    fig_c = bar_base(cities, "Город", "Количество", color_discrete_sequence=[color])
+    fig_c.update_traces(textposition=["inside" if v == cities["Количество"].max() else "outside"
+                                      for v in fig_c.data[0].y])
+    return fig_c
+
+
+def segment_sizes_fig(seg_cnt: pd.DataFrame):
+    fig1 = px.bar(seg_cnt, x="segment", y="Количество", text="Количество",
+                  color_discrete_sequence=[COL_INTERESTS], height=420)
+    fig1.update_traces(textposition=["outside" if v <= 2 else "inside"
+                                     for v in fig1.data[0].y])
+    fig1.update_layout(margin=dict(l=10, r=10, t=40, b=10), xaxis_tickangle=-35)
+    return fig1
+
+
+def segment_gender_fig(df_gender: pd.DataFrame):
+    fig_gender = px.bar(df_gender, x="segment", y="count", color="Пол", text="count",
+                        color_discrete_map=GENDER_COLORS, height=450)
+    fig_gender.update_traces(textposition="inside")
+    fig_gender.update_layout(
+        margin=dict(l=10, r=10, t=60, b=30),
+        legend=dict(orientation="h", y=1.1, x=0.5, xanchor="center", title="")
+    )
+    return fig_gender
+
+
+def bot_share_fig(pct: pd.DataFrame):
+    fig2 = px.bar(pct, x="segment", y="Доля", color="Тип аккаунта",
+                  text=pct["Доля"].apply(lambda v: f"{v:.0%}"),
+                  color_discrete_map=TYPE_COLORS, height=450)
+    fig2.update_traces(hovertemplate="%{y:.0%}")
+    fig2.update_layout(
+        barmode="stack", margin=dict(l=10, r=10, t=60, b=30),
+        legend=dict(orientation="h", y=1.1, x=0.5, xanchor="center", title="")
+    )
+    return fig2
+
+
+def treemap_fig(cnts: pd.DataFrame, root: str = "Все группы"):
+    return px.treemap(cnts, path=[px.Constant(root), "Группа"],
+                      values="Количество", height=550)
+
+
+def segment_medians_fig(med: pd.DataFrame):
+    fig_med = bar_base(med, "segment", "Медиана", color_discrete_sequence=[COL_MEDIAN])
+    fig_med.update_traces(textposition=[
+        "inside" if v == med["Медиана"].max() else "outside" for v in med["Медиана"]
+    ])
+    return fig_med
+
+
+def median_heatmap_fig(hm: pd.DataFrame):
+    fig_hm = px.imshow(
+        hm, labels=dict(x="Тип аккаунта", y="Сегмент", color="Медиана"),
+        height=450, aspect="auto", color_continuous_scale="Blues"
+    )
+    fig_hm.update_layout(margin=dict(l=80, r=10, t=40, b=80))
+    return fig_hm
+
+
+def devices_fig(dev_cnt: pd.DataFrame):
+    fig_dev = px.bar(dev_cnt, x="device", y="count", text="count",
+                     labels={"device":"Устройство","count":"Количество"},
+                     color_discrete_map=DEV_COLORS, height=380)
+    fig_dev.update_traces(textposition="inside")
+    return fig_dev
+
+
+def extreme_gauge_fig(ext: float):
+    return go.Figure(go.Indicator(
+        mode="gauge+number", value=ext, number={"suffix":"%"},
+        title={"text":"> P95 подписок"},
+        gauge={"axis":{"range":[0,100]},
+               "bar":{"color":COL_MALE,"thickness":0.3},
+               "bgcolor":"#e7ecf0",
+               "steps":[{"range":[0,ext],"color":COL_MALE}]}
+    ))
@@ -0,0 +1,175 @@
+# clusters.py
+"""Кластеры аккаунтов с почти одинаковыми подписками: MinHash + LSH."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from groups import GroupMatrix
+
+# 64 MinHash values split into 8 bands of 8: rows whose group sets have
+# Jaccard similarity J share a band with probability 1 - (1 - J^8)^8,
+# i.e. ~0.99 at J = 0.9, ~0.77 at 0.8 and ~0.03 at 0.5.
+PERMUTATIONS = 64
+BANDS = 8
+MIN_GROUPS = 3  # accounts with fewer distinct groups are too generic to cluster
+MIN_SIZE = 3  # smallest cluster reported
+CORE_SHARE = 0.5  # a cluster's core: groups shared by at least this share of members
+SIZE_SATURATION = 100  # cluster size at which size stops raising the score
+LABEL_WEIGHT = 0.2  # weight of the labelled-bot share in the score
+SAMPLE_IDS = 10  # member VK IDs listed in the clusters table
+
+_M1, _M2 = np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB)
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finaliser: uint64 → well-spread uint64."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * _M1
+    x = x ^ (x >> np.uint64(27))
+    x = x * _M2
+    return x ^ (x >> np.uint64(31))
+
+
+class MinHashIndex:
+    """LSH band keys of every row's set of groups (rows of a :class:`GroupMatrix`).
+
+    Group names, not vocabulary ids, are hashed, so keys do not depend on
+    the order groups were interned in and indexes of appended rows can be
+    concatenated. ``sizes`` is the number of distinct groups per row.
+    """
+
+    def __init__(self, keys: np.ndarray, sizes: np.ndarray):
+        self.keys = keys
+        self.sizes = sizes
+
+    @classmethod
+    def build(cls, gm: GroupMatrix, permutations: int = PERMUTATIONS,
+              bands: int = BANDS) -> MinHashIndex:
+        per_row = np.diff(gm.indptr)
+        n, r = gm.n_rows, permutations // bands
+        keys = np.zeros((n, bands), dtype=np.uint64)  # rows without groups keep 0
+        if not len(gm.indices):
+            return cls(keys, per_row)
+        v = max(len(gm.names), 1)
+        pairs = np.unique(np.repeat(np.arange(n, dtype=np.int64), per_row) * v + gm.indices)
+        sizes = np.bincount(pairs // v, minlength=n)
+        base = pd.util.hash_array(gm.names.astype(object))
+        nz = per_row > 0
+        starts = gm.indptr[:-1][nz]  # reduceat over empty rows would cut their neighbours short
+        with np.errstate(over="ignore"):
+            for i in range(bands * r):
+                h = (_mix(base ^ _mix(np.uint64(i + 1))) >> np.uint64(32)).astype(np.uint32)
+                sig = np.minimum.reduceat(h[gm.indices], starts)
+                keys[nz, i // r] = keys[nz, i // r] * _M1 + sig.astype(np.uint64)
+        return cls(keys, sizes)
+
+    def take(self, keep: np.ndarray) -> MinHashIndex:
+        return MinHashIndex(self.keys[keep], self.sizes[keep])
+
+    def append(self, other: MinHashIndex) -> MinHashIndex:
+        return MinHashIndex(np.concatenate([self.keys, other.keys]),
+                            np.concatenate([self.sizes, other.sizes]))
+
+
+def _components(keys: np.ndarray) -> np.ndarray:
+    """Connected components of rows sharing any band key: smallest member as label."""
+    m = len(keys)
+    label = np.arange(m)
+    codes = [pd.factorize(keys[:, b])[0] for b in range(keys.shape[1])]
+    while True:
+        before = label
+        for c in codes:
+            low = np.full(c.max() + 1, m)
+            np.minimum.at(low, c, label)
+            label = np.minimum(label, low[c])
+        while True:  # pointer jumping
+            nxt = label[label]
+            if (nxt == label).all():
+                break
+            label = nxt
+        if (label == before).all():
+            return label
+
+
+@dataclass
+class Clusters:
+    """Clusters table plus the row positions of their members."""
+    table: pd.DataFrame
+    rows: np.ndarray  # member rows, grouped by cluster
+    indptr: np.ndarray  # cluster i owns rows[indptr[i]:indptr[i + 1]]
+
+    def members(self, i: int) -> np.ndarray:
+        return self.rows[self.indptr[i]:self.indptr[i + 1]]
+
+
+def _cohesion(gm: GroupMatrix, rows: np.ndarray, cluster: np.ndarray, sizes: np.ndarray):
+    """Per cluster: core size and mean Jaccard similarity of members to the core."""
+    per_row = np.diff(gm.indptr)[rows]
+    owner = np.repeat(np.arange(len(rows)), per_row)
+    first = np.cumsum(per_row) - per_row  # each member's first entry in the gathered order
+    group = gm.indices[np.repeat(gm.indptr[rows], per_row) + np.arange(len(owner)) - first[owner]]
+    v = max(len(gm.names), 1)
+    pairs = np.unique(owner.astype(np.int64) * v + group)  # distinct groups per member
+    owner, group = pairs // v, pairs % v
+    cells, freq = np.unique(cluster[owner] * v + group, return_counts=True)
+    core = cells[freq >= CORE_SHARE * sizes[cells // v]]
+    core_size = np.bincount(core // v, minlength=len(sizes))
+    in_core = np.isin(cluster[owner] * v + group, core)
+    inter = np.bincount(owner, weights=in_core, minlength=len(rows))
+    distinct = np.bincount(owner, minlength=len(rows))
+    union = distinct + core_size[cluster] - inter
+    jaccard = np.divide(inter, union, out=np.zeros(len(rows)), where=union > 0)
+    return core_size, np.bincount(cluster, weights=jaccard, minlength=len(sizes)) / sizes
+
+
+def score(similarity: np.ndarray, size: np.ndarray, bot_share: np.ndarray) -> np.ndarray:
+    """0–1: how alike the members' subscriptions are, scaled up with cluster size;
+    the share of members already labelled as bots adds LABEL_WEIGHT at most."""
+    grow = np.minimum(np.log(size) / np.log(SIZE_SATURATION), 1.0)
+    return (1 - LABEL_WEIGHT) * similarity * (0.5 + 0.5 * grow) + LABEL_WEIGHT * bot_share
+
+
+def find(data: pd.DataFrame, gm: GroupMatrix, lsh: MinHashIndex,
+         rows: np.ndarray | None = None, min_size: int = MIN_SIZE) -> Clusters:
+    """Clusters of near-identical group sets among ``rows`` (a boolean mask) of ``data``.
+
+    Rows are only compared within LSH buckets, so the cost grows with the
+    number of rows rather than pairs. Clusters come ranked by score.
+    """
+    pick = lsh.sizes >= MIN_GROUPS
+    if rows is not None:
+        pick &= rows
+    cand = np.flatnonzero(pick)
+    label = _components(lsh.keys[cand]) if len(cand) else np.array([], dtype=np.int64)
+    roots, cluster, sizes = np.unique(label, return_inverse=True, return_counts=True)
+    big = sizes >= min_size
+    keep = big[cluster]
+    cand, cluster = cand[keep], (np.cumsum(big) - 1)[cluster[keep]]
+    sizes = sizes[big]
+
+    core, similarity = _cohesion(gm, cand, cluster, sizes)
+    bots = np.bincount(cluster, weights=(data["Тип аккаунта"].to_numpy()[cand] == "бот"),
+                       minlength=len(sizes)) / np.maximum(sizes, 1)
+    scores = score(similarity, sizes, bots)
+
+    order = np.lexsort((-sizes, -scores))
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    by_rank = np.argsort(rank[cluster], kind="stable")
+    members = cand[by_rank]
+    indptr = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes[order], out=indptr[1:])
+    ids = data["VK ID"].to_numpy()
+    sample = [", ".join(map(str, ids[members[a:min(b, a + SAMPLE_IDS)]]))
+              + (" …" if b - a > SAMPLE_IDS else "") for a, b in zip(indptr[:-1], indptr[1:])]
+    table = pd.DataFrame({"Кластер": np.arange(1, len(order) + 1),
+                          "Аккаунтов": sizes[order],
+                          "Групп в ядре": core[order],
+                          "Сходство": similarity[order].round(3),
+                          "Доля ботов": bots[order].round(3),
+                          "Оценка": scores[order].round(3),
+                          "VK ID": sample})
+    return Clusters(table, members, indptr)
@@ -0,0 +1,211 @@
+# cube.py
+"""Предагрегированный куб для страниц «Обзор» и «Активность»."""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+DIMS = ["segment", "Пол", "Тип аккаунта", "Лет", "Устройство визита в VK"]
+MEASURE = "group_count"
+
+# group_count sketches are exact while the column has at most MAX_EXACT
+# distinct values; beyond that values fall into log buckets of width GAMMA.
+MAX_EXACT = 2048
+GAMMA = 1.01
+
+
+def _quantile(bins: np.ndarray, counts: np.ndarray, q: float) -> float:
+    """Linear-interpolated quantile (pandas' default) from a value histogram."""
+    total = counts.sum()
+    if total == 0:
+        return float("nan")
+    pos = q * (total - 1)
+    lo, hi = int(np.floor(pos)), int(np.ceil(pos))
+    cum = np.cumsum(counts)
+    v_lo = bins[np.searchsorted(cum, lo, side="right")]
+    v_hi = bins[np.searchsorted(cum, hi, side="right")]
+    return float(v_lo + (v_hi - v_lo) * (pos - lo))
+
+
+class Cube:
+    """Row counts and ``group_count`` sketches per combination of :data:`DIMS`.
+
+    ``cells`` holds one row per observed combination with the columns ``n``
+    (rows), ``gc_n`` (non-null measure values), ``gc_sum`` and ``gc_sq``.
+    The sketch is a sparse histogram ``(cell, bin) -> count`` over shared
+    bins, so cells can be summed in any grouping and medians/P95 read from
+    the result.
+    """
+
+    def __init__(self, cells: pd.DataFrame, sk_cell: np.ndarray, sk_bin: np.ndarray,
+                 sk_cnt: np.ndarray, bins: np.ndarray, exact: bool):
+        self.cells = cells
+        self.sk_cell, self.sk_bin, self.sk_cnt = sk_cell, sk_bin, sk_cnt
+        self.bins = bins
+        self.exact = exact
+
+    # ── build ──
+    @classmethod
+    def build(cls, df: pd.DataFrame) -> Cube:
+        codes, uniques = [], []
+        for dim in DIMS:
+            c, u = pd.factorize(df[dim], use_na_sentinel=False)
+            codes.append(c)
+            uniques.append(np.asarray(u, dtype=float if dim == "Лет" else object))
+        flat = np.ravel_multi_index(codes, [max(len(u), 1) for u in uniques])
+        ids, cell = np.unique(flat, return_inverse=True)
+        parts = np.unravel_index(ids, [max(len(u), 1) for u in uniques])
+        cells = pd.DataFrame({d: u[p] for d, u, p in zip(DIMS, uniques, parts)})
+
+        gc = df[MEASURE].to_numpy(dtype="float64", na_value=np.nan)
+        valid = ~np.isnan(gc)
+        cells["n"] = np.bincount(cell, minlength=len(ids))
+        cells["gc_n"] = np.bincount(cell[valid], minlength=len(ids))
+        cells["gc_sum"] = np.bincount(cell[valid], weights=gc[valid], minlength=len(ids))
+        cells["gc_sq"] = np.bincount(cell[valid], weights=gc[valid] ** 2, minlength=len(ids))
+
+        values = np.unique(gc[valid])
+        if len(values) <= MAX_EXACT:
+            bins, exact = values, True
+            b = np.searchsorted(bins, gc[valid])
+        else:
+            b = cls._log_bin(gc[valid])
+            bins, exact = cls._log_values(int(b.max()) + 1), False
+        sk_cell, sk_bin, sk_cnt = cls._sparse(cell[valid], b, len(bins))
+        return cls(cells, sk_cell, sk_bin, sk_cnt, bins, exact)
+
+    @staticmethod
+    def _log_bin(v: np.ndarray) -> np.ndarray:
+        return np.floor(np.log1p(np.clip(v, 0, None)) / np.log(GAMMA)).astype(np.int64)
+
+    @staticmethod
+    def _log_values(size: int) -> np.ndarray:
+        k = np.arange(size)
+        return np.expm1(np.log(GAMMA) * (k + 0.5))
+
+    @staticmethod
+    def _sparse(cell: np.ndarray, b: np.ndarray, nbins: int, weights: np.ndarray | None = None):
+        flat, inv = np.unique(cell.astype(np.int64) * nbins + b, return_inverse=True)
+        cnt = np.bincount(inv, weights=weights, minlength=len(flat))
+        cnt = cnt.astype(np.int64) if weights is not None else cnt
+        return flat // nbins, flat % nbins, cnt
+
+    @classmethod
+    def merge(cls, cubes: list[Cube], signs: list[int] | None = None) -> Cube:
+        """Cube of the concatenated rows, from the parts' cubes alone.
+
+        A part with sign -1 is subtracted (rows removed from the others).
+        Exact sketches stay exact while the union of their values fits in
+        MAX_EXACT; otherwise every part is re-bucketed to the log bins.
+        """
+        if len(cubes) == 1 and not signs:
+            return cubes[0]
+        signs = signs or [1] * len(cubes)
+        measures = ["n", "gc_n", "gc_sum", "gc_sq"]
+        cells = pd.concat([c.cells.assign(**{m: c.cells[m] * sign for m in measures})
+                           for c, sign in zip(cubes, signs)], ignore_index=True)
+        grouped = cells.groupby(DIMS, dropna=False, sort=False)
+        gid = grouped.ngroup().to_numpy()
+        merged = grouped[measures].sum().reset_index()
+
+        exact = all(c.exact for c in cubes)
+        if exact:
+            bins = np.unique(np.concatenate([c.bins for c in cubes]))
+            exact = len(bins) <= MAX_EXACT
+        offsets = np.cumsum([0] + [len(c.cells) for c in cubes])
+        sk_cell, sk_bin, sk_cnt = [], [], []
+        for c, off, sign in zip(cubes, offsets, signs):
+            sk_cell.append(gid[off + c.sk_cell])
+            values = c.bins[c.sk_bin]
+            if exact:
+                sk_bin.append(np.searchsorted(bins, values))
+            else:  # exact values fall into their log bucket; log bins map onto themselves
+                sk_bin.append(c.sk_bin if not c.exact else cls._log_bin(values))
+            sk_cnt.append(c.sk_cnt * sign)
+        b = np.concatenate(sk_bin)
+        if not exact:
+            bins = cls._log_values(int(b.max()) + 1 if len(b) else 0)
+        cell, b, cnt = cls._sparse(np.concatenate(sk_cell), b, max(len(bins), 1),
+                                   weights=np.concatenate(sk_cnt).astype(float))
+        if any(sign < 0 for sign in signs):  # drop what the subtraction emptied
+            live = merged["n"].to_numpy() != 0
+            new_id = np.cumsum(live) - 1
+            merged = merged[live].reset_index(drop=True)
+            nz = cnt != 0
+            cell, b, cnt = new_id[cell[nz]], b[nz], cnt[nz]
+        return cls(merged, cell, b, cnt, bins, exact)
+
+    def update(self, removed: pd.DataFrame, added: pd.DataFrame) -> Cube:
+        """This cube without the ``removed`` rows and with the ``added`` ones."""
+        parts, signs = [self], [1]
+        for rows, sign in ((added, 1), (removed, -1)):
+            if len(rows):
+                parts.append(Cube.build(rows))
+                signs.append(sign)
+        return Cube.merge(parts, signs) if len(parts) > 1 else self
+
+    # ── slicing ──
+    def slice(self, selection: dict, age_range=None) -> Cube:
+        """Cells matching the dashboard filters (same semantics as isin/between)."""
+        if age_range is None:
+            keep = np.ones(len(self.cells), dtype=bool)
+        else:
+            keep = self.cells["Лет"].between(*age_range).to_numpy()
+        for col, vals in selection.items():
+            keep &= self.cells[col].isin(list(vals)).to_numpy()
+        new_id = np.cumsum(keep) - 1
+        sel = keep[self.sk_cell]
+        cells = self.cells[keep].reset_index(drop=True)
+        return Cube(cells, new_id[self.sk_cell[sel]], self.sk_bin[sel],
+                    self.sk_cnt[sel], self.bins, self.exact)
+
+    # ── queries ──
+    def total(self) -> int:
+        return int(self.cells["n"].sum())
+
+    def counts(self, by) -> pd.Series:
+        """Row counts per value of ``by`` (NaN kept), like ``value_counts(dropna=False)``."""
+        out = self.cells.groupby(by, dropna=False, sort=False)["n"].sum()
+        return out.sort_values(ascending=False, kind="stable")
+
+    def age_mean(self) -> float:
+        c = self.cells.dropna(subset=["Лет"])
+        n = c["n"].sum()
+        return float((c["Лет"] * c["n"]).sum() / n) if n else float("nan")
+
+    def mean(self) -> float:
+        n = self.cells["gc_n"].sum()
+        return float(self.cells["gc_sum"].sum() / n) if n else float("nan")
+
+    def std(self) -> float:
+        """Sample standard deviation of ``group_count`` (ddof=1, like pandas)."""
+        n = self.cells["gc_n"].sum()
+        if n < 2:
+            return float("nan")
+        s, sq = self.cells["gc_sum"].sum(), self.cells["gc_sq"].sum()
+        return float(np.sqrt(max(sq - s * s / n, 0.0) / (n - 1)))
+
+    def _hist(self) -> np.ndarray:
+        return np.bincount(self.sk_bin, weights=self.sk_cnt, minlength=len(self.bins))
+
+    def quantile(self, q: float, by=None):
+        """Quantile of ``group_count`` overall or per group of ``by`` (NaN groups dropped)."""
+        if by is None:
+            return _quantile(self.bins, self._hist(), q)
+        grouped = self.cells.groupby(by, observed=True, sort=False)
+        gid = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)  # NaN keys: dropped
+        nb = len(self.bins)
+        e_gid = gid[self.sk_cell]
+        sel = e_gid >= 0
+        hists = np.bincount(e_gid[sel] * nb + self.sk_bin[sel], weights=self.sk_cnt[sel],
+                            minlength=grouped.ngroups * nb).reshape(grouped.ngroups, nb)
+        index = grouped.size().index
+        return pd.Series([_quantile(self.bins, h, q) for h in hists], index=index, dtype=float)
+
+    def share_above(self, threshold: float) -> float:
+        """Fraction of rows with ``group_count > threshold`` (null counts as not above)."""
+        n = self.total()
+        if not n:
+            return float("nan")
+        hist = self._hist()
+        return float(hist[self.bins > threshold].sum() / n)
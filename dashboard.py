@@ -1,34 +1,27 @@
 # dashboard.py
 """Основной многостраничный дашборд."""
+import functools
+import json
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from helpers import vc_df, hide_idx
-
-# ───────────────────────────  ЦВЕТОВЫЕ КОНСТАНТЫ  ───────────────────────
-COL_FEMALE     = "#FFB6C1"
-COL_MALE       = "#4682B4"
-COL_BOT        = "#7B9EA8"
-COL_USER       = "#A3C9A8"
-COL_SEGMENT    = "#C3B1E1"
-COL_CITY       = "#E4C7A8"
-COL_INTERESTS  = "#79C7C5"
-COL_MEDIAN     = "#E8A798"
-DEV_COLORS     = {
-    "WEB": "#B0C4DE",
-    "WEB Mobile": "#D1BAC4",
-    "IOS app": "#C1E1C1",
-    "Android app": "#C1DDE8"
-}
-COL_BOTS_CITY  = "#D1C4E9"
+import analytics as an
+import charts
+from helpers import counts_df, hide_idx
+from ingest import REQ
+from filter_index import FilterIndex
+from cube import Cube
+from groups import GroupMatrix
+from clusters import MinHashIndex
+from figcache import ResultCache
+from store import DatasetStore
+from jobs import IngestJobs
+from charts import SCATTER_MODES, age_subs_scatter
+from export import FORMATS, export
+from detect import METHODS, TOP_K, DetectConfig
+from profiling import Profiler, chrome_trace, stage
 
 # ───────────────────────────  ОЖИДАЕМЫЕ КОЛОНКИ  ───────────────────────
-REQ = {
-    "segment", "Тип аккаунта", "Пол", "Лет",
-    "Устройство визита в VK", "group_count", "VK ID"
-}
 def _check(df: pd.DataFrame):
     missing = REQ - set(df.columns)
     if missing:
@@ -40,290 +33,348 @@ def metric(col, label, val, delta=None):
     with col:
         st.metric(label, val, delta)
 
-def bar_base(df: pd.DataFrame, x: str, y: str, **kw):
-    fig = px.bar(df, x=x, y=y, text_auto=".0s", height=380,
-                 labels={x: "", y: "Количество"}, **kw)
-    fig.update_layout(margin=dict(l=10, r=10, t=40, b=10))
-    fig.update_traces(hovertemplate=f"{x}: %{{x}}<br>Количество: %{{y:,}}")
-    return fig
+def dataset_key(df: pd.DataFrame) -> str:
+    return df.attrs.get("dataset_key") or f"id{id(df)}"
+
+@st.cache_resource(show_spinner=False)
+def dataset_store() -> DatasetStore:
+    """Process-wide registry of uploaded datasets shared by all sessions."""
+    return DatasetStore()
+
+@st.cache_resource(show_spinner=False)
+def ingest_jobs() -> IngestJobs:
+    """Process-wide background reads of uploads, joined by retries and other sessions."""
+    return IngestJobs(dataset_store())
+
+def _derived(key: str, df: pd.DataFrame, name: str, build):
+    """Structure built once per stored dataset; unregistered frames are not cached."""
+    try:
+        return dataset_store().derived(key, name, build)
+    except KeyError:
+        return build(df)
+
+def _filter_index(key: str, df: pd.DataFrame) -> FilterIndex:
+    return _derived(key, df, "index", FilterIndex)
+
+def _cube(key: str, df: pd.DataFrame) -> Cube:
+    return _derived(key, df, "cube", Cube.build)
+
+def _groups(key: str, df: pd.DataFrame) -> GroupMatrix | None:
+    return _derived(key, df, "groups", GroupMatrix.build)
+
+def _minhash(key: str, df: pd.DataFrame, gm: GroupMatrix) -> MinHashIndex:
+    return _derived(key, df, "minhash", lambda _: MinHashIndex.build(gm))
+
+@st.cache_resource(show_spinner=False)
+def _results() -> ResultCache:
+    """Process-wide figure/aggregate cache shared by all sessions."""
+    return ResultCache()
+
+def filter_state(selection: dict, age_range) -> tuple:
+    """Hashable, order-insensitive form of the filter widgets."""
+    return tuple(tuple(sorted(map(str, v))) for v in selection.values()) + (tuple(age_range),)
+
+def _cache_stats(cache: ResultCache):
+    s = cache.stats()
+    st.sidebar.caption(f"Кеш: {s['hits']} попаданий / {s['misses']} промахов · "
+                       f"{s['bytes'] / 2**20:.1f} из {s['budget'] / 2**20:.0f} МБ")
+    d = dataset_store().stats()
+    st.sidebar.caption(f"Датасеты: {d['resident']} в памяти из {d['datasets']} · "
+                       f"сессий {d['sessions']} · "
+                       f"{d['bytes'] / 2**20:.0f} из {d['budget'] / 2**20:.0f} МБ")
+    st.sidebar.caption("© 2025 Segment Viewer")
+
+def profile_panel(prof: Profiler, runs: list):
+    """Sidebar table of the run's stages plus a Chrome-trace download of recent runs."""
+    with st.sidebar.expander(f"⏱️ Профиль: {prof.total:.2f} с", expanded=False):
+        tbl = pd.DataFrame([{"Этап": "\u2003" * r["depth"] + r["name"],
+                             "мс": round(r.get("seconds", 0.0) * 1000, 1),
+                             "Пик, МБ": round(r["peak_mb"], 1) if "peak_mb" in r else None}
+                            for r in prof.records])
+        st.dataframe(tbl, use_container_width=True, hide_index=True)
+        st.download_button("💾 Трейс JSON", json.dumps(chrome_trace(runs), ensure_ascii=False),
+                           f"segment_viewer_trace_{int(prof.started)}.json",
+                           mime="application/json", key="profile_trace")
+
+PAGE_SIZES = [50, 100, 500, 1000]
+
+def paged_table(df: pd.DataFrame, rows: np.ndarray, columns: list, key: str):
+    """Show one page of ``df.iloc[rows]``; only the visible window is materialised."""
+    n = len(rows)
+    c1, c2 = st.columns([1, 3])
+    size = c1.selectbox("Строк на странице", PAGE_SIZES, index=1, key=f"{key}_size")
+    pages = max(1, -(-n // size))
+    page = f"{key}_page"  # state-owned: no ``value`` argument to conflict with it
+    st.session_state[page] = min(max(st.session_state.setdefault(page, 1), 1), pages)
+    page_no = c2.number_input(f"Страница (из {pages})", min_value=1, max_value=pages, key=page)
+    start = (page_no - 1) * size
+    with stage("table"):
+        st.dataframe(df.iloc[rows[start:start + size]][columns],
+                     use_container_width=True, hide_index=True)
+    st.caption(f"Строки {min(start + 1, n)}–{min(start + size, n)} из {n}")
+
+def export_button(df: pd.DataFrame, rows, columns, stem: str, key: str, sig):
+    """Format picker plus an on-demand export written in chunks to a temp file."""
+    c1, c2 = st.columns([1, 3])
+    fmt = c1.selectbox("Формат", list(FORMATS), format_func=lambda f: FORMATS[f][0],
+                       key=f"{key}_fmt")
+    slot = f"{key}_file"
+    prev = st.session_state.get(slot)
+    if prev and prev[0] != (sig, fmt):
+        prev[1].unlink(missing_ok=True)
+        del st.session_state[slot]
+    with c2:
+        if slot not in st.session_state and st.button("📦 Подготовить файл", key=f"{key}_prepare"):
+            try:
+                with stage(f"export {fmt}"):
+                    st.session_state[slot] = ((sig, fmt), export(df, fmt, rows, columns))
+            except ValueError as e:
+                st.error(str(e))
+        if slot in st.session_state and st.session_state[slot][1].exists():
+            with open(st.session_state[slot][1], "rb") as f:
+                st.download_button(f"💾 Скачать {FORMATS[fmt][0]}", f, f"{stem}.{fmt}",
+                                   mime=FORMATS[fmt][1], key=f"{key}_download")
+
+def detector_settings() -> tuple[DetectConfig, int]:
+    """Sidebar controls shared by the Активность and Боты pages."""
+    with st.sidebar.expander("🕵️ Детектор подозрительных"):
+        method = st.selectbox("Порог", list(METHODS), format_func=METHODS.get, key="det_method")
+        q = st.slider("Перцентиль", 80, 99, 95, key="det_q") / 100
+        z = st.slider("z-оценка", 1.0, 5.0, 3.0, step=0.5, key="det_z")
+        k = st.number_input("Показать топ", 10, 100_000, TOP_K, step=100, key="det_top")
+    return DetectConfig(method, q, z), int(k)
+
+# ─────────────────────────────  ОБЗОР  ─────────────────────────────────
+def overview(view: Cube, m: dict, chart, cities, names, surnames, approx: bool = False):
+    """«🏠 Обзор»: ``chart(widget, build)`` draws a figure; tables come from thunks."""
+    mark = "≈ " if approx else ""
+    c1, c2, c3, c4, c5 = st.columns(5)
+    metric(c1, mark + "Всего записей", m["total"])
+    metric(c2, mark + "% ботов", f"{m['bot_share']*100:.0f}%")
+    metric(c3, mark + "Средний возраст", f"{m['age_mean']:.1f}")
+    metric(c4, mark + "Топ-сегмент", m["top_segment"])
+    metric(c5, mark + "Медиана подписок", int(m["median"]))
+
+    st.subheader("⭐ TOP-5 сегментов")
+    chart("top5", lambda: charts.top_segments_fig(an.segment_sizes(view, top=5)))
+
+    g1, g2 = st.columns(2)
+    with g1:
+        st.subheader("🧑‍🤝‍🧑 Пол")
+        chart("gender", lambda: charts.gender_fig(an.gender_counts(view)))
+    with g2:
+        st.subheader("📊 Гистограмма возраста")
+        chart("age", lambda: charts.age_fig(an.age_counts(view)))
+
+    st.subheader("🏙️ ТОП-10 городов")
+    chart("cities", lambda: charts.cities_fig(cities()))
+
+    t1, t2 = st.columns(2)
+    with t1:
+        st.subheader("👤 ТОП-5 имён")
+        st.dataframe(names(), use_container_width=True, hide_index=True)
+    with t2:
+        st.subheader("📛 ТОП-5 фамилий")
+        st.dataframe(surnames(), use_container_width=True, hide_index=True)
+
+def partial_overview(view: Cube, counts: dict, rows: int, fraction: float):
+    """Обзор of the rows read so far while the upload is still loading."""
+    read = f"{rows:,}".replace(",", " ")
+    st.warning(f"⏳ Предварительные данные: прочитано {read} строк (~{fraction:.0%}). "
+               "Значения уточнятся, когда файл загрузится полностью.")
+
+    def chart(widget, build):
+        st.plotly_chart(build(), use_container_width=True)
+
+    def values(col: str):
+        name = an.OVERVIEW_VALUES[col]
+        return lambda: hide_idx(counts_df(counts[col], top=5, x_name=name, y_name="Количество"))
+
+    overview(view, an.overview_metrics(view), chart,
+             cities=lambda: an.cities_table(counts["cities"]),
+             names=values("ИМЯ"), surnames=values("ФАМИЛИЯ"), approx=True)
 
 # ────────────────────────────  DASHBOARD  ──────────────────────────────
 def run_dashboard(df: pd.DataFrame):
     _check(df)
+    key = dataset_key(df)
+    with stage("indexes"):
+        fidx = _filter_index(key, df)
+        cube = _cube(key, df)
+        cache = _results()
 
     # ФИЛЬТРЫ
-    with st.expander("Фильтры", expanded=True):
-        segments = sorted(df["segment"].dropna().unique())
-        types    = df["Тип аккаунта"].unique()
-        genders  = df["Пол"].dropna().unique()
-        amin, amax = int(df["Лет"].min()), int(df["Лет"].max())
+    with stage("filters"), st.expander("Фильтры", expanded=True):
+        segments = sorted(v for v in fidx.values["segment"] if pd.notna(v))
+        types    = fidx.values["Тип аккаунта"]
+        genders  = [v for v in fidx.values["Пол"] if pd.notna(v)]
+        amin, amax = (int(v) for v in fidx.age_bounds)
 
         s_seg = st.multiselect("Сегмент", segments, default=segments)
         s_type= st.multiselect("Тип аккаунта", types, default=types)
         s_sex = st.multiselect("Пол", genders, default=genders)
         age_range = st.slider("Возраст", amin, amax, (amin, amax), step=1)
 
-    data = df[
-        df["segment"].isin(s_seg) &
-        df["Тип аккаунта"].isin(s_type) &
-        df["Пол"].isin(s_sex) &
-        df["Лет"].between(*age_range)
-    ]
+    selection = {"segment": s_seg, "Тип аккаунта": s_type, "Пол": s_sex}
+    with stage("mask"):
+        mask = fidx.mask(selection, age_range)
+    with stage("cube_slice"):
+        view = cube.slice(selection, age_range)
+
+    @functools.lru_cache(maxsize=None)
+    def filtered() -> pd.DataFrame:
+        with stage("filter_rows"):
+            return df[mask]
 
     # НАВИГАЦИЯ
     page = st.sidebar.radio(
         "Страница",
         ["🏠 Обзор", "🎯 Интересы", "📊 Активность", "🤖 Боты", "📋 Группы", "📑 Данные"]
     )
-    st.sidebar.caption("© 2025 Segment Viewer")
+    state = (key, filter_state(selection, age_range), page)
+    if page in ("📊 Активность", "🤖 Боты"):
+        det, top = detector_settings()
 
-    # ─────────────────────────  1. Обзор  ──────────────────────────
-    if page == "🏠 Обзор":
-        c1, c2, c3, c4, c5 = st.columns(5)
-        metric(c1, "Всего записей", len(data))
-        metric(c2, "% ботов", f"{data['Тип аккаунта'].eq('бот').mean()*100:.0f}%")
-        metric(c3, "Средний возраст", f"{data['Лет'].mean():.1f}")
-        metric(c4, "Топ-сегмент", data['segment'].mode()[0] if not data.empty else "—")
-        metric(c5, "Медиана подписок", int(data["group_count"].median()))
-
-        st.subheader("⭐ TOP-5 сегментов")
-        top5 = vc_df(data["segment"], top=5, x_name="Сегмент", y_name="Количество")
-        fig = px.bar(top5, x="Сегмент", y="Количество", text="Количество",
-                     color_discrete_sequence=[COL_SEGMENT], height=380)
-        fig.update_traces(textposition="inside")
-        st.plotly_chart(fig, use_container_width=True)
-
-        g1, g2 = st.columns(2)
-        with g1:
-            st.subheader("🧑‍🤝‍🧑 Пол")
-            pie = px.pie(vc_df(data["Пол"], x_name="Пол", y_name="Количество"),
-                         names="Пол", values="Количество", hole=0.4, height=350,
-                         color_discrete_map={"женский": COL_FEMALE, "мужской": COL_MALE})
-            pie.update_traces(textposition="inside", textinfo="percent+label")
-            st.plotly_chart(pie, use_container_width=True)
-        with g2:
-            st.subheader("📊 Гистограмма возраста")
-            hist = px.histogram(data, x="Лет", nbins=10,
-                                labels={"Лет":"Возраст","count":"Количество"},
-                                height=350, color_discrete_sequence=[COL_MALE])
-            hist.update_layout(margin=dict(l=10, r=10, t=40, b=10))
-            hist.update_yaxes(title="Количество")
-            st.plotly_chart(hist, use_container_width=True)
-
-        st.subheader("🏙️ TOP-10 городов")
-        cities = vc_df(data["РОДНОЙ ГОРОД"].str.lower().fillna("Неизвестно"),
-                       top=10, x_name="ГородLower", y_name="Количество")
-        cities["Город"] = cities["ГородLower"].str.title()
-        fig_c = bar_base(cities.sort_values("Количество", ascending=False),
-                         "Город", "Количество",
-                         color_discrete_sequence=[COL_CITY])
-        fig_c.update_traces(textposition=["inside" if v == cities["Количество"].max() else "outside"
-                                          for v in fig_c.data[0].y])
-        st.plotly_chart(fig_c, use_container_width=True)
-
-        t1, t2 = st.columns(2)
-        with t1:
-            st.subheader("👤 ТОП-5 имён")
-            st.dataframe(hide_idx(vc_df(data["ИМЯ"], top=5, x_name="Имя", y_name="Количество")),
-                         use_container_width=True, hide_index=True)
-        with t2:
-            st.subheader("📛 ТОП-5 фамилий")
-            st.dataframe(hide_idx(vc_df(data["ФАМИЛИЯ"], top=5, x_name="Фамилия", y_name="Количество")),
-                         use_container_width=True, hide_index=True)
-
-    # ─────────────────────────  2. Интересы  ──────────────────────────
-    elif page == "🎯 Интересы":
-        st.subheader("📊 Размер сегментов")
-        seg_cnt = vc_df(data["segment"], x_name="segment", y_name="Количество")\
-                    .sort_values("Количество", ascending=False)
-        fig1 = px.bar(seg_cnt, x="segment", y="Количество", text="Количество",
-                      color_discrete_sequence=[COL_INTERESTS], height=420)
-        fig1.update_traces(textposition=["outside" if v <= 2 else "inside"
-                                         for v in fig1.data[0].y])
-        fig1.update_layout(margin=dict(l=10, r=10, t=40, b=10), xaxis_tickangle=-35)
-        st.plotly_chart(fig1, use_container_width=True)
-
-        st.subheader("🧑‍🤝‍🧑 Распределение сегментов по полу")
-        df_gender = data.groupby(["segment","Пол"])["VK ID"].count()\
-                         .reset_index(name="count")
-        fig_gender = px.bar(df_gender, x="segment", y="count", color="Пол", text="count",
-                            color_discrete_map={"женский": COL_FEMALE, "мужской": COL_MALE},
-                            height=450)
-        fig_gender.update_traces(textposition="inside")
-        fig_gender.update_layout(
-            margin=dict(l=10, r=10, t=60, b=30),
-            legend=dict(orientation="h", y=1.1, x=0.5, xanchor="center", title="")
-        )
-        st.plotly_chart(fig_gender, use_container_width=True)
-
-        st.subheader("🤖 Доля ботов внутри сегмента")
-        share = data.groupby(["segment","Тип аккаунта"])["VK ID"].count()\
-                      .unstack(fill_value=0)
-        pct = share.div(share.sum(axis=1), axis=0)\
-                   .reset_index()\
-                   .melt(id_vars="segment", var_name="Тип аккаунта", value_name="Доля")
-        fig2 = px.bar(pct, x="segment", y="Доля", color="Тип аккаунта",
-                      text=pct["Доля"].apply(lambda v: f"{v:.0%}"),
-                      color_discrete_map={"бот": COL_BOT, "пользователь": COL_USER},
-                      height=450)
-        fig2.update_traces(hovertemplate="%{y:.0%}")
-        fig2.update_layout(
-            barmode="stack", margin=dict(l=10, r=10, t=60, b=30),
-            legend=dict(orientation="h", y=1.1, x=0.5, xanchor="center", title="")
-        )
-        st.plotly_chart(fig2, use_container_width=True)
-
-        st.subheader("🌳 Карта групп")
-        seg_opts = ["Все"] + seg_cnt["segment"].tolist()
-        sel = st.selectbox("Сегмент", seg_opts, index=0)
-        group_cols = [c for c in data.columns if c.startswith("group_") and c.endswith("_name")]
-        if group_cols:
-            m = (data.melt(id_vars=["segment"], value_vars=group_cols, value_name="Группа")
-                    .dropna(subset=["Группа"])
-                    .assign(Группа=lambda d: d["Группа"].str.strip()))
-            if sel != "Все":
-                m = m[m["segment"] == sel]
-            cnts = (m["Группа"].value_counts()
-                       .reset_index(name="Количество")
-                       .rename(columns={"index":"Группа"})
-                       .sort_values(["Количество","Группа"], ascending=[False,True]))
-            fig3 = px.treemap(cnts,
-                              path=[px.Constant(sel if sel!="Все" else "Все группы"), "Группа"],
-                              values="Количество", height=550)
-            st.plotly_chart(fig3, use_container_width=True)
-            st.subheader("🏆 TOP-10 групп")
-            st.dataframe(cnts.head(10), use_container_width=True, hide_index=True)
-        else:
-            st.info("Нет колонок group_*_name для карты групп.")
-
-    # ─────────────────────────  3. Активность  ──────────────────────────
-    elif page == "📊 Активность":
-        m1, m2 = st.columns(2)
-        metric(m1, "Среднее подписок", f"{data['group_count'].mean():.1f}")
-        metric(m2, "Медиана подписок", int(data["group_count"].median()))
-
-        st.subheader("🏅 Медиана подписок по сегментам (TOP-10)")
-        med = data.groupby("segment")["group_count"].median()\
-                  .reset_index(name="Медиана")\
-                  .sort_values("Медиана", ascending=False).head(10)
-        fig_med = bar_base(med, "segment", "Медиана", color_discrete_sequence=[COL_MEDIAN])
-        fig_med.update_traces(textposition=[
-            "inside" if v == med["Медиана"].max() else "outside" for v in med["Медиана"]
-        ])
-        st.plotly_chart(fig_med, use_container_width=True)
-
-        st.subheader("🌡️ Медиана подписок: сегмент × тип аккаунта")
-        hm = data.pivot_table(
-            index="segment", columns="Тип аккаунта",
-            values="group_count", aggfunc="median", fill_value=0
-        )
-        fig_hm = px.imshow(
-            hm, labels=dict(x="Тип аккаунта", y="Сегмент", color="Медиана"),
-            height=450, aspect="auto", color_continuous_scale="Blues"
-        )
-        fig_hm.update_layout(margin=dict(l=80, r=10, t=40, b=80))
-        st.plotly_chart(fig_hm, use_container_width=True)
-
-        st.subheader("📱 Устройства визита в VK")
-        devs = data["Устройство визита в VK"].map({
-            "vk.com":"WEB", "m.vk.com":"WEB Mobile",
-            "Android app":"Android app", "iPhone app":"IOS app"
-        }).fillna(data["Устройство визита в VK"])
-        dev_cnt = vc_df(devs, x_name="device", y_name="count")
-        fig_dev = px.bar(dev_cnt, x="device", y="count", text="count",
-                         labels={"device":"Устройство","count":"Количество"},
-                         color_discrete_map=DEV_COLORS, height=380)
-        fig_dev.update_traces(textposition="inside")
-        st.plotly_chart(fig_dev, use_container_width=True)
-
-        st.subheader("🔍 Подписки vs Возраст")
-        fig_sc = px.scatter(data, x="Лет", y="group_count", color="Тип аккаунта",
-                            labels={"Лет":"Возраст","group_count":"Подписки"},
-                            color_discrete_map={"бот": COL_BOT, "пользователь": COL_USER},
-                            height=380)
-        st.plotly_chart(fig_sc, use_container_width=True)
-
-        st.subheader("📊 Доля экстремально активных (>P95)")
-        p95 = data["group_count"].quantile(0.95)
-        ext = data["group_count"].gt(p95).mean() * 100
-        gauge = go.Figure(go.Indicator(
-            mode="gauge+number", value=ext, number={"suffix":"%"},
-            title={"text":"> P95 подписок"},
-            gauge={"axis":{"range":[0,100]},
-                   "bar":{"color":COL_MALE,"thickness":0.3},
-                   "bgcolor":"#e7ecf0",
-                   "steps":[{"range":[0,ext],"color":COL_MALE}]}
-        ))
-        st.plotly_chart(gauge, use_container_width=True)
-
-        st.subheader("🕵️ Подозрительные пользователи (>P95 подписок)")
-        sus = data[data["group_count"] > p95][["VK ID","ИМЯ","ФАМИЛИЯ","group_count"]]
-        sus["Профиль"] = sus.apply(
-            lambda r: f"[{r['ИМЯ']} {r['ФАМИЛИЯ']}](https://vk.com/id{r['VK ID']})", axis=1
-        )
-        st.dataframe(hide_idx(sus.rename(columns={"group_count":"Подписки"})),
-                     use_container_width=True, hide_index=True)
+    def agg(widget, compute):
+        with stage(f"agg {widget}"):
+            return cache.get_or_compute(state + (widget,), compute)
 
-    # ─────────────────────────  4. Боты  ──────────────────────────
-    elif page == "🤖 Боты":
-        bots = data[data["Тип аккаунта"] == "бот"]
-        p95b = df["group_count"].quantile(0.95)
-        b1, b2, b3 = st.columns(3)
-        metric(b1, "Всего ботов", len(bots))
-        metric(b2, "% ботов", f"{len(bots)/len(data)*100:.0f}%")
-        metric(b3, "Медиана подписок (боты)", int(bots["group_count"].median()))
-
-        st.subheader("👨‍👩‍👧‍👦 Пол ботов")
-        pie2 = px.pie(vc_df(bots["Пол"], x_name="Пол", y_name="Количество"),
-                      names="Пол", values="Количество", hole=0.4, height=350,
-                      color_discrete_map={"женский": COL_FEMALE, "мужской": COL_MALE})
-        pie2.update_traces(textposition="inside", textinfo="percent+label")
-        st.plotly_chart(pie2, use_container_width=True)
-
-        st.subheader("🏙️ ТОП-10 городов (боты)")
-        bc = vc_df(bots["РОДНОЙ ГОРОД"].str.lower().fillna("Неизвестно"),
-                   top=10, x_name="ГородLower", y_name="Количество")
-        bc["Город"] = bc["ГородLower"].str.title()
-        fig7 = bar_base(bc.sort_values("Количество", ascending=False),
-                        "Город", "Количество",
-                        color_discrete_sequence=[COL_BOTS_CITY])
-        fig7.update_traces(textposition=["inside" if v == bc["Количество"].max() else "outside"
-                                         for v in fig7.data[0].y])
-        st.plotly_chart(fig7, use_container_width=True)
-
-        st.subheader("🕵️ Подозрительные боты (group_count > P95)")
-        susb = bots[bots["group_count"] > p95b][["VK ID","segment","group_count"]]
-        susb["Ссылка"] = susb["VK ID"].apply(
-            lambda x: f"[vk.com/id{x}](https://vk.com/id{x})"
-        )
-        st.dataframe(hide_idx(susb.rename(columns={"group_count":"Подписки"})),
-                     use_container_width=True, hide_index=True)
+    def chart(widget, build):
+        with stage(f"chart {widget}"):
+            with stage("figure"):
+                fig = cache.figure(state + (widget,), build)
+            with stage("send"):
+                st.plotly_chart(fig, use_container_width=True)
+
+    with stage(f"page {page}"):
+        # ─────────────────────────  1. Обзор  ──────────────────────────
+        if page == "🏠 Обзор":
+            overview(view, agg("metrics", lambda: an.overview_metrics(view)), chart,
+                     cities=lambda: an.top_cities(filtered()),
+                     names=lambda: agg("names", lambda: hide_idx(
+                         an.top_values(filtered(), "ИМЯ", "Имя"))),
+                     surnames=lambda: agg("surnames", lambda: hide_idx(
+                         an.top_values(filtered(), "ФАМИЛИЯ", "Фамилия"))))
+
+        # ─────────────────────────  2. Интересы  ──────────────────────────
+        elif page == "🎯 Интересы":
+            st.subheader("📊 Размер сегментов")
+            seg_cnt = an.segment_sizes(view)
+            chart("segments", lambda: charts.segment_sizes_fig(seg_cnt))
+
+            st.subheader("🧑‍🤝‍🧑 Распределение сегментов по полу")
+            chart("seg_gender", lambda: charts.segment_gender_fig(an.segment_gender(filtered())))
+
+            st.subheader("🤖 Доля ботов внутри сегмента")
+            chart("bot_share", lambda: charts.bot_share_fig(an.bot_share(filtered())))
+
+            st.subheader("🌳 Карта групп")
+            seg_opts = ["Все"] + seg_cnt["segment"].tolist()
+            sel = st.selectbox("Сегмент", seg_opts, index=0)
+            gm = _groups(key, df)
+            if gm is not None:
+                rows = mask if sel == "Все" else mask & fidx.value_mask("segment", sel)
+                cnts = agg(("groups", sel), lambda: an.group_counts(gm, rows))
+                root = sel if sel != "Все" else "Все группы"
+                chart(("treemap", sel), lambda: charts.treemap_fig(cnts, root))
+                st.subheader("🏆 TOP-10 групп")
+                st.dataframe(cnts.head(10), use_container_width=True, hide_index=True)
+            else:
+                st.info("Нет колонок group_*_name для карты групп.")
+
+        # ─────────────────────────  3. Активность  ──────────────────────────
+        elif page == "📊 Активность":
+            m = agg("metrics", lambda: an.activity_metrics(view))
+            m1, m2 = st.columns(2)
+            metric(m1, "Среднее подписок", f"{m['mean']:.1f}")
+            metric(m2, "Медиана подписок", int(m["median"]))
+
+            st.subheader("🏅 Медиана подписок по сегментам (TOP-10)")
+            chart("median", lambda: charts.segment_medians_fig(an.segment_medians(view)))
+
+            st.subheader("🌡️ Медиана подписок: сегмент × тип аккаунта")
+            chart("heatmap", lambda: charts.median_heatmap_fig(an.median_heatmap(view)))
+
+            st.subheader("📱 Устройства визита в VK")
+            chart("devices", lambda: charts.devices_fig(an.device_counts(view)))
+
+            st.subheader("🔍 Подписки vs Возраст")
+            sc_mode = st.radio("Отображение", list(SCATTER_MODES), horizontal=True,
+                               format_func=SCATTER_MODES.get, key="scatter_mode")
+            chart(("scatter", sc_mode), lambda: age_subs_scatter(filtered(), mode=sc_mode))
+
+            st.subheader("📊 Доля экстремально активных (>P95)")
+            chart("gauge", lambda: charts.extreme_gauge_fig(m["extreme_share"] * 100))
+
+            st.subheader(f"🕵️ Подозрительные пользователи (подписки > {det.label})")
+            sus = agg(("suspicious", det, top),
+                      lambda: hide_idx(an.suspicious_users(filtered(), view, det, top)))
+            st.dataframe(sus, use_container_width=True, hide_index=True)
+
+        # ─────────────────────────  4. Боты  ──────────────────────────
+        elif page == "🤖 Боты":
+            m = agg("metrics", lambda: an.bot_metrics(view))
+            b1, b2, b3 = st.columns(3)
+            metric(b1, "Всего ботов", m["bots"])
+            metric(b2, "% ботов", f"{m['bot_share']*100:.0f}%")
+            metric(b3, "Медиана подписок (боты)", int(m["median"]))
+
+            st.subheader("👨‍👩‍👧‍👦 Пол ботов")
+            chart("bot_gender", lambda: charts.gender_fig(an.gender_counts(an.bot_view(view))))
+
+            st.subheader("🏙️ ТОП-10 городов (боты)")
+            chart("bot_cities", lambda: charts.cities_fig(an.top_cities(an.bot_rows(filtered())),
+                                                          color=charts.COL_BOTS_CITY))
+
+            st.subheader(f"🕵️ Подозрительные боты (group_count > {det.label})")
+            susb = agg(("suspicious", det, top),
+                       lambda: hide_idx(an.suspicious_bots(filtered(), view, det, top)))
+            st.dataframe(susb, use_container_width=True, hide_index=True)
+
+            st.subheader("🧬 Кластеры с почти одинаковыми подписками")
+            gm = _groups(key, df)
+            if gm is None:
+                st.info("Нет колонок group_*_name для поиска кластеров.")
+            else:
+                lsh = _minhash(key, df, gm)
+                cl = agg("clusters", lambda: an.bot_clusters(df, gm, lsh, mask))
+                if cl.table.empty:
+                    st.info("Кластеров не найдено.")
+                else:
+                    st.dataframe(cl.table, use_container_width=True, hide_index=True,
+                                 column_config={"Оценка": st.column_config.ProgressColumn(
+                                     "Оценка", min_value=0.0, max_value=1.0, format="%.2f")})
+                    pick = st.selectbox("Участники кластера", cl.table["Кластер"],
+                                        key="cluster_pick")
+                    rows = cl.members(pick - 1)
+                    cols = ["VK ID", "ИМЯ", "ФАМИЛИЯ", "Тип аккаунта", "segment", "group_count"]
+                    paged_table(df, rows, cols, "cluster_members")
+                    export_button(df, rows, cols, f"cluster_{pick}", "cluster_export",
+                                  state + (pick,))
+
+        # ─────────────────────────  5. Группы  ──────────────────────────
+        elif page == "📋 Группы":
+            st.subheader("📋 Все группы и число подписчиков")
+            gm = _groups(key, df)
+            if gm is None:
+                st.info("Нет колонок group_*_name в данных.")
+                _cache_stats(cache)
+                return
+            cnts = agg("groups", lambda: an.group_counts(gm, mask))
+            st.dataframe(cnts, use_container_width=True, hide_index=True)
+            export_button(cnts, None, None, "groups_counts", "groups_export", state)
+
+        # ─────────────────────────  6. Данные  ──────────────────────────
+        else:
+            st.subheader("📑 Таблица фильтрованных данных")
+            if df.attrs.get("skipped"):
+                st.caption("Загружаются только колонки, которые использует дашборд. "
+                           "Нет в таблице и выгрузке: " + ", ".join(map(str, df.attrs["skipped"])))
+            rows = np.flatnonzero(mask)
+            cols = df.columns.tolist()
+            cols.remove("VK ID"); cols.remove("Тип аккаунта")
+            order = ["VK ID","Тип аккаунта"] + cols
+            paged_table(df, rows, order, "data_table")
+            export_button(df, rows, order, "filtered_data", "data_export", state)
 
-    # ─────────────────────────  5. Группы  ──────────────────────────
-    elif page == "📋 Группы":
-        st.subheader("📋 Все группы и число подписчиков")
-        group_cols = [c for c in data.columns if c.startswith("group_") and c.endswith("_name")]
-        if not group_cols:
-            st.info("Нет колонок group_*_name в данных.")
-            return
-        melted = data.melt(id_vars=["segment"], value_vars=group_cols, value_name="Группа")\
-                     .dropna(subset=["Группа"]).assign(Группа=lambda d: d["Группа"].str.strip())
-        cnts = (melted["Группа"].value_counts()
-                       .reset_index(name="Количество")
-                       .rename(columns={"index":"Группа"})
-                       .sort_values("Количество", ascending=False))
-        st.dataframe(cnts, use_container_width=True, hide_index=True)
-        st.download_button("💾 Скачать CSV",
-                           cnts.to_csv(index=False).encode(),
-                           "groups_counts.csv", mime="text/csv")
-
-    # ─────────────────────────  6. Данные  ──────────────────────────
-    else:
-        st.subheader("📑 Таблица фильтрованных данных")
-        cols = df.columns.tolist()
-        cols.remove("VK ID"); cols.remove("Тип аккаунта")
-        order = ["VK ID","Тип аккаунта"] + cols
-        st.dataframe(data[order], use_container_width=True, hide_index=True)
-        st.download_button("💾 Скачать CSV",
-                           data[order].to_csv(index=False).encode(),
-                           "filtered_data.csv", mime="text/csv")
+    _cache_stats(cache)
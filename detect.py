@@ -0,0 +1,84 @@
+# detect.py
+"""Поиск подозрительно активных аккаунтов по числу подписок."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from cube import Cube
+
+METHODS = {
+    "percentile": "Перцентиль",
+    "segment": "Перцентиль по сегменту",
+    "zscore": "z-оценка",
+}
+TOP_K = 1000
+
+
+@dataclass(frozen=True)
+class DetectConfig:
+    """Threshold rule for ``group_count``; hashable so it can key caches."""
+    method: str = "percentile"
+    q: float = 0.95
+    z: float = 3.0
+
+    @property
+    def label(self) -> str:
+        if self.method == "zscore":
+            return f"μ+{self.z:g}σ"
+        suffix = " по сегменту" if self.method == "segment" else ""
+        return f"P{self.q * 100:g}{suffix}"
+
+
+def threshold(view: Cube, cfg: DetectConfig) -> float | pd.Series:
+    """Cut-off from the cube's group_count sketch: a scalar, or per segment."""
+    if cfg.method == "zscore":
+        return view.mean() + cfg.z * view.std()
+    if cfg.method == "segment":
+        return view.quantile(cfg.q, by="segment")
+    return view.quantile(cfg.q)
+
+
+def profile_links(df: pd.DataFrame) -> pd.Series:
+    """``[Имя Фамилия](https://vk.com/id…)`` built column-wise."""
+    ids = df["VK ID"].astype(str)
+    return ("[" + df["ИМЯ"].astype(str) + " " + df["ФАМИЛИЯ"].astype(str)
+            + "](https://vk.com/id" + ids + ")")
+
+
+def id_links(df: pd.DataFrame) -> pd.Series:
+    """``[vk.com/id…](https://vk.com/id…)`` built column-wise."""
+    ids = df["VK ID"].astype(str)
+    return "[vk.com/id" + ids + "](https://vk.com/id" + ids + ")"
+
+
+def top_k(values: np.ndarray, k: int | None) -> np.ndarray:
+    """Positions of the ``k`` largest values, largest first (partial sort)."""
+    if k is not None and len(values) > k:
+        part = np.argpartition(-values, k - 1)[:k]
+    else:
+        part = np.arange(len(values))
+    return part[np.argsort(-values[part], kind="stable")]
+
+
+def suspicious(data: pd.DataFrame, view: Cube, cfg: DetectConfig = DetectConfig(),
+               k: int | None = TOP_K) -> pd.DataFrame:
+    """Rows of ``data`` above the threshold, ranked by group_count, at most ``k``.
+
+    The cut-off comes from ``view``, the cube slice of the filtered
+    audience; ``data`` may be a subset of it (e.g. bots only), so every
+    page flags the same accounts. Adds ``Порог``, the threshold per row.
+    """
+    thr = threshold(view, cfg)
+    if isinstance(thr, pd.Series):
+        cut = data["segment"].map(thr).astype(float).to_numpy()
+    else:
+        cut = np.full(len(data), thr)
+    gc = data["group_count"].to_numpy(dtype="float64", na_value=np.nan)
+    hit = np.flatnonzero(gc > cut)  # NaN on either side never flags
+    order = hit[top_k(gc[hit], k)]
+    out = data.iloc[order].copy()
+    out["Порог"] = cut[order]
+    return out
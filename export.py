@@ -0,0 +1,105 @@
+# export.py
+"""Потоковая выгрузка таблиц в CSV/Parquet/XLSX через временный файл."""
+from __future__ import annotations
+
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+EXPORT_CHUNK_ROWS = int(os.environ.get("SEGMENT_VIEWER_EXPORT_CHUNK_ROWS", 100_000))
+EXPORT_DIR = Path(tempfile.gettempdir()) / "segment_viewer_exports"
+EXPORT_TTL = 3600  # seconds an abandoned export file is kept
+XLSX_MAX_ROWS = 1_048_575  # sheet limit minus the header row
+
+FORMATS = {
+    "csv": ("CSV", "text/csv"),
+    "parquet": ("Parquet", "application/vnd.apache.parquet"),
+    "xlsx": ("Excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+}
+
+
+def iter_chunks(df: pd.DataFrame, rows: np.ndarray | None = None, columns=None,
+                chunk_rows: int = EXPORT_CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """Yield ``df.iloc[rows][columns]`` in slices of ``chunk_rows`` without building it whole."""
+    columns = list(df.columns) if columns is None else list(columns)
+    n = len(df) if rows is None else len(rows)
+    for start in range(0, max(n, 1), chunk_rows):  # an empty export still gets a header
+        part = slice(start, start + chunk_rows) if rows is None else rows[start:start + chunk_rows]
+        yield df.iloc[part][columns]
+
+
+def _write_csv(chunks, path: Path) -> None:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(f, header=i == 0, index=False)
+
+
+def _write_parquet(chunks, path: Path) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(path, table.schema, compression="zstd")
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_xlsx(chunks, path: Path) -> None:
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    written = 0
+    for i, chunk in enumerate(chunks):
+        if i == 0:
+            ws.append([str(c) for c in chunk.columns])
+        written += len(chunk)
+        if written > XLSX_MAX_ROWS:
+            raise ValueError(f"Excel вмещает не более {XLSX_MAX_ROWS:,} строк".replace(",", " "))
+        clean = chunk.astype(object).where(chunk.notna(), None)
+        for row in clean.itertuples(index=False, name=None):
+            ws.append(row)
+    wb.save(path)
+
+
+WRITERS = {"csv": _write_csv, "parquet": _write_parquet, "xlsx": _write_xlsx}
+
+
+def _sweep(now: float) -> None:
+    for old in EXPORT_DIR.glob("*"):
+        try:
+            if now - old.stat().st_mtime > EXPORT_TTL:
+                old.unlink()
+        except OSError:
+            pass
+
+
+def export(df: pd.DataFrame, fmt: str, rows: np.ndarray | None = None, columns=None,
+           chunk_rows: int = EXPORT_CHUNK_ROWS) -> Path:
+    """Write the selected rows/columns to a temp file chunk by chunk and return its path.
+
+    Peak memory is one chunk plus the writer's buffers; the caller owns the
+    returned file and should delete it when done.
+    """
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    _sweep(time.time())
+    fd, name = tempfile.mkstemp(suffix=f".{fmt}", dir=EXPORT_DIR)
+    os.close(fd)
+    path = Path(name)
+    try:
+        WRITERS[fmt](iter_chunks(df, rows, columns, chunk_rows), path)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
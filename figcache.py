@@ -0,0 +1,97 @@
+# figcache.py
+"""Кеш агрегатов и графиков с LRU-вытеснением по бюджету памяти."""
+from __future__ import annotations
+
+import json
+import os
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import numpy as np
+import pandas as pd
+import plotly.io as pio
+
+BUDGET_MB = float(os.environ.get("SEGMENT_VIEWER_FIGCACHE_MB", 256))
+
+
+def sizeof(value: Any) -> int:
+    """Approximate resident size of a cached value in bytes."""
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        usage = value.memory_usage(deep=True, index=True)
+        return int(usage.sum() if isinstance(value, pd.DataFrame) else usage)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sizeof(v) for v in value.values())
+    if hasattr(value, "__dict__"):  # FilterIndex, Cube, GroupMatrix…
+        return sys.getsizeof(value) + sizeof(vars(value))
+    return sys.getsizeof(value)
+
+
+class ResultCache:
+    """Thread-safe LRU of computed aggregates and serialized figures.
+
+    Keys are ``(dataset key, filter state, page, widget)`` tuples. Entries
+    are evicted least-recently-used first once their total size exceeds
+    ``budget`` bytes; a single entry larger than the budget is not stored.
+    """
+
+    def __init__(self, budget: int = int(BUDGET_MB * 2**20)):
+        self.budget = budget
+        self.size = 0
+        self.hits = self.misses = self.evictions = 0
+        self._items: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key][0]
+            self.misses += 1
+        value = compute()
+        self._put(key, value)
+        return value
+
+    def figure(self, key: Hashable, build: Callable[[], Any]):
+        """Plotly figure stored as JSON, returned as the dict ``st.plotly_chart`` takes.
+
+        Hits are not re-validated into a Figure, except ones without traces:
+        Streamlit rejects an empty ``data`` list in a dict.
+        """
+        cached = self.get_or_compute(key, lambda: build().to_json())
+        fig = json.loads(cached)
+        return fig if fig.get("data") else pio.from_json(cached)
+
+    def _put(self, key: Hashable, value: Any) -> None:
+        size = sizeof(value)
+        if size > self.budget:
+            return
+        with self._lock:
+            if key in self._items:
+                self.size -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.budget:
+                _, (_, freed) = self._items.popitem(last=False)
+                self.size -= freed
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        return {"entries": len(self._items), "bytes": self.size, "budget": self.budget,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,134 @@
+# filter_index.py
+"""Индекс фильтров: битовые маски значений и отсортированный возраст."""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+FILTER_COLS = ("segment", "Тип аккаунта", "Пол")
+AGE_COL = "Лет"
+MEMO_SIZE = 8
+
+
+class FilterIndex:
+    """Per-value bitmaps for the categorical filters plus a sorted age index.
+
+    Bitmaps are ``np.packbits`` arrays of length ``ceil(n / 8)``; a filter
+    state is answered with byte-wise OR (within a column) and AND (across
+    columns). Results are memoized per filter state.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.n = len(df)
+        self.values: dict[str, list] = {}
+        self._bitmaps: dict[str, list[np.ndarray]] = {}
+        for col in FILTER_COLS:
+            codes, uniques = pd.factorize(df[col], use_na_sentinel=False)
+            self.values[col] = list(uniques)
+            self._bitmaps[col] = [np.packbits(codes == k) for k in range(len(uniques))]
+
+        age = df[AGE_COL].to_numpy(dtype="float64", na_value=np.nan)
+        valid = ~np.isnan(age)
+        order = np.argsort(age, kind="stable")[: int(valid.sum())]
+        self._age_order = order
+        self._age_sorted = age[order]
+        self._age_valid = np.packbits(valid)
+        self._init_memo()
+
+    def _init_memo(self) -> None:
+        self._memo: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = 0
+
+    def update(self, keep: np.ndarray, new: pd.DataFrame) -> FilterIndex:
+        """Index of this index's ``keep`` rows followed by ``new``.
+
+        Existing bitmaps are compacted and extended; only ``new`` is
+        factorized. Values left without rows are dropped.
+        """
+        out = FilterIndex.__new__(FilterIndex)
+        kept = int(keep.sum())
+        out.n = kept + len(new)
+        out.values, out._bitmaps = {}, {}
+        for col in FILTER_COLS:
+            codes, uniques = pd.factorize(new[col], use_na_sentinel=False)
+            values = list(self.values[col])
+            old = [np.unpackbits(b, count=self.n).view(bool)[keep] for b in self._bitmaps[col]]
+            pos = pd.Index(values, dtype=object).get_indexer(uniques)
+            for k in np.flatnonzero(pos < 0):
+                pos[k] = len(values)
+                values.append(uniques[k])
+                old.append(np.zeros(kept, dtype=bool))
+            new_pos = pos[codes]
+            out.values[col], out._bitmaps[col] = [], []
+            for p, (value, bits) in enumerate(zip(values, old)):
+                hit = np.concatenate([bits, new_pos == p])
+                if hit.any():
+                    out.values[col].append(value)
+                    out._bitmaps[col].append(np.packbits(hit))
+
+        new_id = np.cumsum(keep) - 1
+        stay = keep[self._age_order]
+        age = new[AGE_COL].to_numpy(dtype="float64", na_value=np.nan)
+        valid = ~np.isnan(age)
+        order = np.argsort(age, kind="stable")[: int(valid.sum())]
+        ages = np.concatenate([self._age_sorted[stay], age[order]])
+        rows = np.concatenate([new_id[self._age_order[stay]], order + kept])
+        merge = np.argsort(ages, kind="stable")  # two sorted runs; old rows first on ties
+        out._age_order, out._age_sorted = rows[merge], ages[merge]
+        old_valid = np.unpackbits(self._age_valid, count=self.n).view(bool)[keep]
+        out._age_valid = np.packbits(np.concatenate([old_valid, valid]))
+        out._init_memo()
+        return out
+
+    @property
+    def age_bounds(self) -> tuple[float, float]:
+        if not len(self._age_sorted):
+            return 0.0, 0.0
+        return float(self._age_sorted[0]), float(self._age_sorted[-1])
+
+    def value_mask(self, col: str, value) -> np.ndarray:
+        """Boolean row mask of ``col == value`` straight from its bitmap."""
+        return np.unpackbits(self._union(col, [value]), count=self.n).view(bool)
+
+    def _union(self, col: str, selected) -> np.ndarray:
+        pos = pd.Index(self.values[col]).get_indexer(list(selected))
+        maps = [self._bitmaps[col][p] for p in pos if p >= 0]
+        if not maps:
+            return np.zeros_like(self._age_valid)
+        return np.bitwise_or.reduce(maps)
+
+    def _age(self, lo, hi) -> np.ndarray:
+        a = np.searchsorted(self._age_sorted, lo, side="left")
+        b = np.searchsorted(self._age_sorted, hi, side="right")
+        if a == 0 and b == len(self._age_sorted):
+            return self._age_valid
+        hit = np.zeros(self.n, dtype=bool)
+        hit[self._age_order[a:b]] = True
+        return np.packbits(hit)
+
+    def mask(self, selection: dict, age_range) -> np.ndarray:
+        """Boolean row mask for ``{column: selected values}`` and an age range."""
+        key = (tuple(frozenset(selection.get(c, ())) for c in FILTER_COLS),
+               tuple(age_range))
+        with self._lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                self.hits += 1
+                return self._memo[key]
+            self.misses += 1
+
+        bits = self._age(*age_range)
+        for col in FILTER_COLS:
+            bits = bits & self._union(col, selection.get(col, ()))
+        out = np.unpackbits(bits, count=self.n).view(bool)
+        out.flags.writeable = False
+
+        with self._lock:
+            self._memo[key] = out
+            while len(self._memo) > MEMO_SIZE:
+                self._memo.popitem(last=False)
+        return out
@@ -0,0 +1,84 @@
+# groups.py
+"""Разреженная матрица подписок пользователь × группа (CSR)."""
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from ingest import is_group_col
+
+
+class GroupMatrix:
+    """Group names interned to integer ids with memberships stored as CSR.
+
+    Row ``i`` of the matrix lists the group ids of row ``i`` of the source
+    frame in ``indices[indptr[i]:indptr[i + 1]]``. One entry is kept per
+    non-empty ``group_*_name`` cell, so counts match ``melt`` +
+    ``value_counts`` over the stripped names.
+    """
+
+    def __init__(self, names: np.ndarray, indptr: np.ndarray, indices: np.ndarray):
+        self.names = names
+        self.indptr = indptr
+        self.indices = indices
+
+    @property
+    def n_rows(self) -> int:
+        return len(self.indptr) - 1
+
+    @classmethod
+    def build(cls, df: pd.DataFrame) -> GroupMatrix | None:
+        cols = [c for c in df.columns if is_group_col(c)]
+        if not cols:
+            return None
+        vocab: dict[str, int] = {}
+        parts = []
+        for col in cols:
+            codes, uniques = pd.factorize(df[col].astype(object).str.strip())
+            remap = np.array([vocab.setdefault(u, len(vocab)) for u in uniques],
+                             dtype=np.int32)
+            rows = np.flatnonzero(codes >= 0)
+            parts.append((rows, remap[codes[rows]]))
+        per_row = np.zeros(len(df), dtype=np.int64)
+        for rows, _ in parts:
+            per_row[rows] += 1
+        indptr = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(per_row, out=indptr[1:])
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        cursor = indptr[:-1].copy()
+        for rows, ids in parts:  # one entry per row per column, in column order
+            indices[cursor[rows]] = ids
+            cursor[rows] += 1
+        return cls(np.array(list(vocab), dtype=object), indptr, indices)
+
+    @classmethod
+    def empty(cls, n_rows: int) -> GroupMatrix:
+        return cls(np.array([], dtype=object), np.zeros(n_rows + 1, dtype=np.int64),
+                   np.array([], dtype=np.int32))
+
+    def take(self, keep: np.ndarray) -> GroupMatrix:
+        """Rows of a boolean mask, in order; the group vocabulary is kept as is."""
+        per_row = np.diff(self.indptr)
+        indptr = np.zeros(int(keep.sum()) + 1, dtype=np.int64)
+        np.cumsum(per_row[keep], out=indptr[1:])
+        return GroupMatrix(self.names, indptr, self.indices[np.repeat(keep, per_row)])
+
+    def append(self, other: GroupMatrix) -> GroupMatrix:
+        """Rows of ``other`` after this matrix's; only its vocabulary is remapped."""
+        pos = pd.Index(self.names, dtype=object).get_indexer(other.names)
+        fresh = pos < 0
+        pos[fresh] = len(self.names) + np.arange(int(fresh.sum()))
+        names = np.concatenate([self.names, other.names[fresh]])
+        indptr = np.concatenate([self.indptr, self.indptr[-1] + other.indptr[1:]])
+        indices = np.concatenate([self.indices, pos[other.indices].astype(np.int32)])
+        return GroupMatrix(names, indptr, indices)
+
+    def counts(self, rows: np.ndarray | None = None) -> pd.DataFrame:
+        """Members per group over a boolean row mask (all rows if ``None``)."""
+        if rows is None:
+            idx = self.indices
+        else:
+            idx = self.indices[np.repeat(rows, np.diff(self.indptr))]
+        cnt = np.bincount(idx, minlength=len(self.names))
+        hit = np.flatnonzero(cnt)
+        return pd.DataFrame({"Группа": self.names[hit], "Количество": cnt[hit]})
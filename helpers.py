@@ -5,9 +5,16 @@ def vc_df(series: pd.Series, *, top: int | None = None,
           x_name: str = "x", y_name: str = "count") -> pd.DataFrame:
     """Convert a value_counts Series into a tidy DataFrame."""
     out = series.value_counts(dropna=False)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        out = out[out > 0]  # unused categories of a filtered slice
+    return counts_df(out, top=top, x_name=x_name, y_name=y_name)
+
+def counts_df(counts: pd.Series, *, top: int | None = None,
+              x_name: str = "x", y_name: str = "count") -> pd.DataFrame:
+    """Convert an already aggregated counts Series into a tidy DataFrame."""
     if top:
-        out = out.head(top)
-    df = out.reset_index()
+        counts = counts.head(top)
+    df = counts.reset_index()
     df.columns = [x_name, y_name]
     return df
 
@@ -0,0 +1,480 @@
+# ingest.py
+"""Загрузка выгрузок с кешем на диске (Parquet, категориальные колонки)."""
+from __future__ import annotations
+
+import functools
+import hashlib
+import os
+import posixpath
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Callable, Iterator
+from xml.etree import ElementTree
+from xml.parsers import expat
+
+import pandas as pd
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils.datetime import MAC_EPOCH, WINDOWS_EPOCH, from_excel, from_ISO8601
+from pandas.api.types import union_categoricals
+
+from profiling import stage
+
+# Column synonyms
+ALIASES = {
+    "segment": ["segment"],
+    "Тип аккаунта": ["Тип аккаунта"],
+    "Пол": ["Пол", "ПОЛ"],
+    "Лет": ["Лет", "Возраст", "ЛЕТ"],
+    "Устройство визита в VK": ["Устройство визита в VK", "УСТРОЙСТВО ВИЗИТА В ВК"],
+}
+
+# Columns every dashboard page relies on
+REQ = {
+    "segment", "Тип аккаунта", "Пол", "Лет",
+    "Устройство визита в VK", "group_count", "VK ID"
+}
+
+# Columns the dashboard reads besides the aliased ones and group_*_name
+EXTRA = ["VK ID", "group_count", "ИМЯ", "ФАМИЛИЯ", "РОДНОЙ ГОРОД"]
+
+# Low-cardinality columns stored as pandas categoricals
+CATEGORICAL = ["segment", "Пол", "Тип аккаунта", "Устройство визита в VK", "РОДНОЙ ГОРОД"]
+
+# Numeric columns downcast to the smallest dtype that holds them
+NUMERIC = ["Лет", "group_count", "VK ID"]
+
+CACHE_DIR = Path(os.environ.get("SEGMENT_VIEWER_CACHE", ".cache/segment_viewer"))
+CACHE_MB = float(os.environ.get("SEGMENT_VIEWER_CACHE_MB", 4096))
+CACHE_TTL = float(os.environ.get("SEGMENT_VIEWER_CACHE_DAYS", 30)) * 86400  # max seconds since last use
+# Part of every cache file name: bump when the columns kept (EXTRA, aliases,
+# group_*_name) or their dtypes (CATEGORICAL, NUMERIC) change, so files
+# written by older code are swept instead of served.
+CACHE_VERSION = 3
+CHUNK_ROWS = int(os.environ.get("SEGMENT_VIEWER_CHUNK_ROWS", 250_000))
+
+Progress = Callable[[int, float], None]
+OnChunk = Callable[[pd.DataFrame], None]
+
+# SpreadsheetML names as expat reports them with namespace_separator=" "
+XL_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+XL_READ_BYTES = 1 << 20
+
+
+def content_hash(raw) -> str:
+    """Stable key of an uploaded file's bytes."""
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def is_group_col(col) -> bool:
+    return isinstance(col, str) and col.startswith("group_") and col.endswith("_name")
+
+
+def canon(df: pd.DataFrame):
+    """Rename columns to canonical names and return missing list"""
+    mapping, missing = _mapping(df.columns)
+    return df.rename(columns=mapping), missing
+
+
+def _mapping(columns):
+    missing = []
+    mapping = {}
+    for name, vars in ALIASES.items():
+        for v in vars:
+            if v in columns:
+                mapping[v] = name
+                break
+        else:
+            missing.append(name)
+    return mapping, missing
+
+
+def _usecols(columns, mapping) -> list:
+    """Source columns the dashboard touches, in file order."""
+    return [c for c in columns if c in mapping or c in EXTRA or is_group_col(c)]
+
+
+def categorize(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert low-cardinality text columns to categoricals in place."""
+    for col in CATEGORICAL:
+        if col in df.columns and df[col].dtype == object:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def downcast(df: pd.DataFrame) -> pd.DataFrame:
+    """Shrink numeric columns in place; ids with gaps stay float64."""
+    for col in NUMERIC:
+        if col not in df.columns or df[col].dtype.kind not in "iuf":
+            continue
+        s = df[col]
+        if not s.isna().any():
+            df[col] = pd.to_numeric(s, downcast="integer")
+        elif col != "VK ID":
+            df[col] = s.astype("float32")
+    return df
+
+
+def _prepare(df: pd.DataFrame, mapping, usecols, header) -> pd.DataFrame:
+    """Canonical chunk; ``attrs["skipped"]`` lists the source columns pruned away."""
+    keep = set(usecols)
+    df = df[usecols].rename(columns=mapping)
+    df.attrs["skipped"] = [c for c in header if c not in keep]
+    return downcast(categorize(df))
+
+
+def _concat(chunks: list[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenate chunks, unifying per-chunk categories first."""
+    if len(chunks) == 1:
+        return chunks[0]
+    for col in chunks[0].columns:
+        if all(col in c and isinstance(c[col].dtype, pd.CategoricalDtype) for c in chunks):
+            cats = union_categoricals([c[col] for c in chunks]).categories
+            for c in chunks:
+                c[col] = c[col].cat.set_categories(cats)
+    return pd.concat(chunks, ignore_index=True)
+
+
+def iter_csv(buf, chunksize: int = CHUNK_ROWS) -> tuple[list, Iterator[pd.DataFrame]]:
+    """Stream a CSV as canonical, pruned chunks; returns (missing, chunks)."""
+    header = pd.read_csv(buf, nrows=0).columns
+    buf.seek(0)
+    mapping, missing = _mapping(header)
+    usecols = _usecols(header, mapping)
+    if missing:
+        return missing, iter([pd.DataFrame(columns=usecols).rename(columns=mapping)])
+    dtype = {c: "category" for c in usecols if mapping.get(c, c) in CATEGORICAL}
+    reader = pd.read_csv(buf, usecols=usecols, dtype=dtype, chunksize=chunksize)
+    return missing, (_prepare(chunk, mapping, usecols, header) for chunk in reader)
+
+
+@functools.lru_cache(maxsize=None)
+def _col_index(letters: str) -> int:
+    """Zero-based column of a reference's letters: ``"AB"`` → 27."""
+    n = 0
+    for ch in letters:
+        n = n * 26 + ord(ch) - 64
+    return n - 1
+
+
+def _date_styles(zf: zipfile.ZipFile, path: str | None) -> set[str]:
+    """Cell styles (the ``s`` attribute) whose number format is a date or time,
+    by the test openpyxl applies. Durations (``[h]:mm``) included: read_excel
+    returns those as times or datetimes too."""
+    if not path or path not in zf.namelist():
+        return set()
+    styles = ElementTree.fromstring(zf.read(path))
+    custom = {f.get("numFmtId"): f.get("formatCode") for f in styles.iter(f"{{{XL_NS}}}numFmt")}
+    xfs = styles.find(f"{{{XL_NS}}}cellXfs")
+    dates = set()
+    for i, xf in enumerate(xfs.findall(f"{{{XL_NS}}}xf") if xfs is not None else []):
+        fid = xf.get("numFmtId", "0")
+        fmt = custom.get(fid) or BUILTIN_FORMATS.get(int(fid))
+        if is_date_format(fmt):
+            dates.add(str(i))
+    return dates
+
+
+def _first_sheet(zf: zipfile.ZipFile) -> tuple[str, list, set, object]:
+    """Path of the workbook's first sheet, its shared strings table, its date
+    styles (see :func:`_date_styles`) and date epoch."""
+    book = ElementTree.fromstring(zf.read("xl/workbook.xml"))
+    rid = book.find(f"{{{XL_NS}}}sheets/{{{XL_NS}}}sheet").get(f"{{{REL_NS}}}id")
+    pr = book.find(f"{{{XL_NS}}}workbookPr")
+    epoch = MAC_EPOCH if pr is not None and pr.get("date1904") in ("1", "true") else WINDOWS_EPOCH
+    rels = ElementTree.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    targets = {r.get("Id"): r.get("Target") for r in rels.iter(f"{{{PKG_NS}}}Relationship")}
+    strings_path = next((posixpath.join("xl", t) for t in targets.values()
+                         if t.endswith("sharedStrings.xml")), None)
+    styles_path = next((posixpath.join("xl", t) for t in targets.values()
+                        if t.endswith("styles.xml")), None)
+    sheet = targets[rid]
+    sheet = sheet.lstrip("/") if sheet.startswith("/") else posixpath.join("xl", sheet)
+    strings = []
+    if strings_path and strings_path in zf.namelist():
+        with zf.open(strings_path) as f:
+            for _, el in ElementTree.iterparse(f):
+                if el.tag == f"{{{XL_NS}}}si":
+                    # plain <t> or rich-text runs <r><t>; phonetic <rPh> is skipped
+                    runs = el.findall(f"{{{XL_NS}}}t") + el.findall(f"{{{XL_NS}}}r/{{{XL_NS}}}t")
+                    strings.append("".join(t.text or "" for t in runs))
+                    el.clear()
+    return sheet, strings, _date_styles(zf, styles_path), epoch
+
+
+def _cell_value(kind: str | None, text: str, strings: list):
+    if kind == "s":
+        return strings[int(text)]
+    if kind in ("inlineStr", "str"):
+        return text
+    if kind == "d":
+        return from_ISO8601(text)
+    if kind == "b":
+        return text == "1"
+    if kind == "e":
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def _serial_date(value, epoch):
+    """A date-formatted number as read_excel returns it: datetime, or time below one day."""
+    try:
+        return from_excel(value, epoch)
+    except (OverflowError, ValueError):  # outside the date range: openpyxl's error value
+        return "#VALUE!"
+
+
+def _dedupe(header: list) -> list:
+    """Header as pandas names it: blanks become ``Unnamed: i``, repeats get ``.1``."""
+    seen, out = {}, []
+    for i, name in enumerate(header):
+        name = f"Unnamed: {i}" if name is None or name == "" else name
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        out.append(name)
+    return out
+
+
+def _xlsx_chunks(buf, pick: Callable[[list], list], chunksize: int) -> Iterator:
+    """Stream the first sheet with expat: yields the header row first, then
+    ``{name: values}`` every ``chunksize`` rows for the columns ``pick(header)``
+    returns. Cells of other columns are skipped before any conversion.
+    """
+    with zipfile.ZipFile(buf) as zf:
+        sheet, strings, dates, epoch = _first_sheet(zf)
+        header: list | None = None
+        keep: dict[int, str] = {}
+        cols: dict[int, list] = {}
+        ready: list = []
+        row: dict = {}
+        parts: list[str] = []
+        texts: dict[str, str] = {}  # one object per distinct inline string, like read_csv
+        col, kind, style, wanted, capture, n = -1, None, None, True, False, 0
+
+        def start(tag, attrs):
+            nonlocal col, kind, style, wanted, capture
+            if tag == C:
+                ref = attrs.get("r")
+                col = _col_index(ref.rstrip("0123456789")) if ref else col + 1
+                kind = attrs.get("t")
+                style = attrs.get("s")
+                wanted = header is None or col in keep
+                parts.clear()
+            elif tag == V or tag == T:
+                capture = wanted
+            elif tag == ROW:
+                col = -1
+
+        def data(text):
+            if capture:
+                parts.append(text)
+
+        def end(tag):
+            nonlocal header, capture, n
+            if tag == C:
+                if wanted and parts:
+                    value = _cell_value(kind, "".join(parts), strings)
+                    if style in dates and (kind is None or kind == "n"):
+                        value = _serial_date(value, epoch)
+                    row[col] = texts.setdefault(value, value) if kind == "inlineStr" else value
+            elif tag == V or tag == T:
+                capture = False
+            elif tag == ROW:
+                if header is None:
+                    header = _dedupe([row.get(j) for j in range(max(row, default=-1) + 1)])
+                    names = set(pick(header))
+                    keep.update((j, h) for j, h in enumerate(header) if h in names)
+                    cols.update((j, []) for j in keep)
+                    ready.append(header)
+                elif row:  # blank rows carry no record
+                    for j, values in cols.items():
+                        values.append(row.get(j))
+                    n += 1
+                    if n == chunksize:
+                        flush()
+                row.clear()
+
+        def flush():
+            nonlocal n
+            ready.append({keep[j]: values for j, values in cols.items()})
+            for j in cols:
+                cols[j] = []
+            n = 0
+
+        C, V, T, ROW = (f"{XL_NS} {t}" for t in ("c", "v", "t", "row"))
+        parser = expat.ParserCreate(namespace_separator=" ")
+        parser.buffer_text = True
+        parser.StartElementHandler, parser.EndElementHandler = start, end
+        parser.CharacterDataHandler = data
+        chunks = 0
+        with zf.open(sheet) as f:
+            while block := f.read(XL_READ_BYTES):
+                parser.Parse(block, False)
+                for item in ready:
+                    chunks += isinstance(item, dict)
+                    yield item
+                ready.clear()
+            parser.Parse(b"", True)
+        if header is None:
+            yield []
+        if n or not chunks:  # an empty sheet still yields one (empty) chunk
+            flush()
+        yield from ready
+
+
+def iter_xlsx(buf, chunksize: int = CHUNK_ROWS) -> tuple[list, Iterator[pd.DataFrame]]:
+    """Stream the first sheet of an .xlsx like :func:`iter_csv`.
+
+    Only the columns the dashboard uses are converted; time and memory grow
+    with them rather than with the sheet width.
+    """
+    rows = _xlsx_chunks(buf, lambda header: _usecols(header, _mapping(header)[0]), chunksize)
+    header = next(rows)
+    mapping, missing = _mapping(header)
+    usecols = _usecols(header, mapping)
+    if missing:
+        rows.close()
+        return missing, iter([pd.DataFrame(columns=usecols).rename(columns=mapping)])
+    return missing, (_prepare(pd.DataFrame(chunk, columns=usecols), mapping, usecols, header)
+                     for chunk in rows)
+
+
+def _parse(buf, name: str, progress: Progress | None, on_chunk: OnChunk | None = None):
+    size = max(buf.seek(0, os.SEEK_END), 1)
+    buf.seek(0)
+    reader = iter_csv if name.lower().endswith(".csv") else iter_xlsx
+    missing, chunks = reader(buf)
+    parts, rows = [], 0
+    for chunk in chunks:
+        parts.append(chunk)
+        rows += len(chunk)
+        if on_chunk and not missing and len(chunk):
+            on_chunk(chunk)
+        if progress:
+            progress(rows, min(buf.tell() / size, 1.0))
+    return _concat(parts), missing
+
+
+def _store(df: pd.DataFrame, path: Path) -> None:
+    """Write the cache file atomically; mixed-type columns are left uncached."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, name = tempfile.mkstemp(prefix=f"{path.name}.", suffix=".tmp", dir=path.parent)
+    os.close(fd)
+    tmp = Path(name)
+    try:
+        df.to_parquet(tmp, compression="zstd", index=False)
+    except (ValueError, TypeError):
+        tmp.unlink(missing_ok=True)
+        return
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, path)
+
+
+def cache_path(key: str, cache_dir: Path = CACHE_DIR) -> Path:
+    return Path(cache_dir) / f"{key}.v{CACHE_VERSION}.parquet"
+
+
+def read_cache(key: str, cache_dir: Path = CACHE_DIR) -> pd.DataFrame:
+    """Frame of a previously loaded dataset from its memory-mapped Parquet file."""
+    path = cache_path(key, cache_dir)
+    with stage("cache_read"):
+        df = pd.read_parquet(path, memory_map=True)
+    try:
+        os.utime(path)  # last use, for the sweep
+    except OSError:
+        pass
+    df.attrs["dataset_key"] = key
+    return df
+
+
+def sweep(cache_dir: Path = CACHE_DIR, keep=(), now: float | None = None,
+          budget: int = int(CACHE_MB * 2**20), ttl: float = CACHE_TTL) -> None:
+    """Delete cache files of other versions, unused for ``ttl`` seconds, and the
+    least recently used ones beyond ``budget`` bytes; paths in ``keep`` stay."""
+    now = time.time() if now is None else now
+    current = f".v{CACHE_VERSION}.parquet"
+    files = []
+    for path in Path(cache_dir).glob("*"):
+        try:
+            info = path.stat()
+        except OSError:
+            continue
+        files.append((info.st_mtime, info.st_size, path))
+    files.sort()  # least recently used first
+    total = sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        if path in keep:
+            continue
+        old_format = path.suffix == ".parquet" and not path.name.endswith(current)
+        over = total > budget and path.name.endswith(current)  # not writes in progress
+        if old_format or over or now - mtime > ttl:
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            total -= size
+
+
+def _load(key: str, buf, name: str, cache_dir, progress: Progress | None,
+          on_chunk: OnChunk | None = None):
+    path = cache_path(key, cache_dir)
+    df, missing = None, []
+    if path.exists():
+        try:
+            df = read_cache(key, cache_dir)
+        except FileNotFoundError:  # swept meanwhile
+            pass
+    if df is None:
+        with stage("parse"):
+            df, missing = _parse(buf, name, progress, on_chunk)
+        if not missing:
+            with stage("cache_write"):
+                _store(df, path)
+    df.attrs["dataset_key"] = key
+    return df, missing
+
+
+def content_key(upload) -> str:
+    """Dataset key of an uploaded file (see :func:`content_hash`).
+
+    ``getvalue()`` returns the bytes the upload shares; ``getbuffer()``
+    would copy them first.
+    """
+    return content_hash(upload.getvalue())
+
+
+def load(upload, cache_dir: Path = CACHE_DIR, progress: Progress | None = None,
+         key: str | None = None, on_chunk: OnChunk | None = None):
+    """Read an uploaded .csv/.xlsx, using the on-disk Parquet cache when possible.
+
+    Returns ``(df, missing)`` like :func:`canon`. The dataset key (content
+    hash, or ``key`` when the caller already has it) is stored in
+    ``df.attrs["dataset_key"]``. ``progress(rows, done)`` is called after
+    every streamed chunk of the CSV or XLSX, and ``on_chunk(chunk)`` with
+    each canonical chunk (not on a cache hit or when columns are missing).
+    """
+    if key is None:
+        with stage("hash"):
+            key = content_key(upload)
+    upload.seek(0)
+    return _load(key, upload, upload.name, cache_dir, progress, on_chunk)
+
+
+def load_path(path, cache_dir: Path = CACHE_DIR, progress: Progress | None = None):
+    """:func:`load` for a file on disk; it is hashed and parsed without reading it whole."""
+    path = Path(path)
+    with open(path, "rb") as f:
+        key = hashlib.file_digest(f, lambda: hashlib.blake2b(digest_size=16)).hexdigest()
+        f.seek(0)
+        return _load(key, f, path.name, cache_dir, progress)
@@ -0,0 +1,176 @@
+# jobs.py
+"""Фоновая загрузка выгрузок с предварительными агрегатами для «Обзора»."""
+from __future__ import annotations
+
+import io
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+import analytics as an
+import profiling
+from cube import Cube
+from ingest import CACHE_DIR, load
+from store import DatasetHandle, DatasetStore
+
+POLL_SECONDS = 1.0  # how often a waiting page reruns to show progress
+KEEP_SECONDS = 300  # finished jobs stay joinable (and their dataset pinned) this long
+
+
+class _ViewReader(io.RawIOBase):
+    """Seekable binary reader over a memoryview: no copy of the upload's bytes."""
+
+    def __init__(self, view: memoryview, name: str):
+        self._view = view
+        self._bytes = view.cast("B")
+        self._pos = 0
+        self.name = name
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = max(min(len(b), len(self._bytes) - self._pos), 0)
+        b[:n] = self._bytes[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._bytes) if size is None or size < 0 else self._pos + size
+        out = self._bytes[self._pos:end].tobytes()
+        self._pos += len(out)
+        return out
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._bytes)}[whence]
+        self._pos = max(base + offset, 0)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        if not self.closed:
+            self._bytes.release()
+            self._view.release()
+        super().close()
+
+
+class IngestJob:
+    """One upload read on a worker thread.
+
+    While running, ``partial()`` gives a cube and Обзор counts of the rows
+    read so far. On success the frame goes to the store and the job holds
+    a handle to it until pruned, so the waiting sessions can ``acquire`` it.
+    With ``profile`` the read is recorded in its own ``profiler``: worker
+    threads do not see the submitting run's profiler, which ends long
+    before the job does.
+    """
+
+    def __init__(self, key: str, upload, store: DatasetStore, cache_dir: Path = CACHE_DIR,
+                 profile: bool = False):
+        self.key = key
+        self.name = upload.name
+        self.state = "running"  # running | done | missing | error
+        self.rows = 0
+        self.fraction = 0.0
+        self.missing: list = []
+        self.error: str | None = None
+        self.finished: float | None = None
+        self.profiler = profiling.Profiler("ingest") if profile else None
+        self._handle: DatasetHandle | None = None
+        self._cube: Cube | None = None
+        self._counts: dict[str, pd.Series] | None = None
+        self._lock = threading.Lock()
+        # a private reader: the session's UploadedFile keeps its own position. getvalue()
+        # shares the upload's bytes; getbuffer() would first copy them out of the share
+        buf = _ViewReader(memoryview(upload.getvalue()), upload.name)
+        self._thread = threading.Thread(target=self._run, args=(buf, store, cache_dir),
+                                        name=f"ingest-{key[:8]}", daemon=True)
+
+    def start(self) -> IngestJob:
+        self._thread.start()
+        return self
+
+    @property
+    def running(self) -> bool:
+        return self.state == "running"
+
+    def partial(self) -> tuple[Cube | None, dict[str, pd.Series] | None]:
+        with self._lock:
+            return self._cube, self._counts
+
+    def _progress(self, rows: int, done: float) -> None:
+        self.rows, self.fraction = rows, done
+
+    def _chunk(self, chunk: pd.DataFrame) -> None:
+        cube, counts = Cube.build(chunk), an.overview_counts(chunk)
+        with self._lock:
+            if self._cube is not None:
+                cube = Cube.merge([self._cube, cube])
+                counts = an.add_counts(self._counts, counts)
+            self._cube, self._counts = cube, counts
+
+    def _run(self, buf, store: DatasetStore, cache_dir: Path) -> None:
+        try:
+            with profiling.activate(self.profiler):
+                df, missing = load(buf, cache_dir, progress=self._progress, key=self.key,
+                                   on_chunk=self._chunk)
+                if missing:
+                    self.missing, self.state = missing, "missing"
+                else:
+                    with profiling.stage("store"):
+                        self._handle = store.put(df)
+                    self.rows, self.fraction = len(df), 1.0
+                    self.state = "done"
+        except Exception as e:
+            self.error, self.state = str(e), "error"
+        finally:
+            buf.close()
+            with self._lock:
+                self._cube = self._counts = None
+            self.finished = time.monotonic()
+
+    def release(self) -> None:
+        if self._handle is not None:
+            self._handle.release()
+            self._handle = None
+
+
+class IngestJobs:
+    """Process-wide ingest jobs keyed by content hash.
+
+    Uploading a file that is already being read (a retry, or another
+    session) joins the running job instead of parsing it a second time.
+    """
+
+    def __init__(self, store: DatasetStore, cache_dir: Path = CACHE_DIR,
+                 keep_seconds: float = KEEP_SECONDS):
+        self.store = store
+        self.cache_dir = cache_dir
+        self.keep_seconds = keep_seconds
+        self._jobs: dict[str, IngestJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, upload, profile: bool = False) -> IngestJob:
+        """The job reading ``upload``: a running or recent one, else a new one."""
+        with self._lock:
+            self._prune()
+            job = self._jobs.get(key)
+            # failed reads may be retried, and reads whose dataset has left the store
+            if job is None or job.state == "error" or (job.state == "done" and key not in self.store):
+                job = self._jobs[key] = IngestJob(key, upload, self.store, self.cache_dir,
+                                                  profile).start()
+            return job
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for key, job in list(self._jobs.items()):
+            if job.finished is not None and now - job.finished > self.keep_seconds:
+                job.release()
+                del self._jobs[key]
@@ -0,0 +1,105 @@
+# merge.py
+"""Дозагрузка выгрузок в открытый датасет с дедупликацией по VK ID."""
+from __future__ import annotations
+
+import hashlib
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from clusters import MinHashIndex
+from groups import GroupMatrix
+from ingest import _concat
+from store import DatasetHandle, DatasetStore
+
+ID = "VK ID"
+RULES = {"newest": "Оставлять новую запись", "existing": "Оставлять существующую запись"}
+
+
+@dataclass
+class MergePlan:
+    """Rows that survive a merge: ``keep`` over the old frame, ``take`` over the new one."""
+    keep: np.ndarray
+    take: np.ndarray
+
+    def stats(self) -> dict:
+        return {"kept": int(self.keep.sum()), "removed": int((~self.keep).sum()),
+                "added": int(self.take.sum()), "skipped": int((~self.take).sum())}
+
+
+def plan(old: pd.Index, new: pd.Index, rule: str = "newest") -> MergePlan:
+    """Deduplicate on VK ID: one row per ID, the later (``newest``) or earlier one.
+
+    Only the new IDs are hashed into a lookup of ``old``; rows without an
+    ID are always kept. A base with repeated IDs is deduplicated by the
+    same rule on its first merge.
+    """
+    if rule not in RULES:
+        raise ValueError(f"unknown rule {rule!r}")
+    dup = "last" if rule == "newest" else "first"
+    valid = old.notna()
+    if old.is_unique:
+        keep, rows, lookup = np.ones(len(old), dtype=bool), None, old
+    else:
+        keep = ~(old.duplicated(keep=dup) & valid)
+        rows = np.flatnonzero(keep & valid)
+        lookup = old[rows]
+    take = ~(new.duplicated(keep=dup) & new.notna())
+    pos = lookup.get_indexer(new)
+    match = (pos >= 0) & take & new.notna()
+    if rule == "newest":
+        hit = pos[match]
+        keep[hit if rows is None else rows[hit]] = False
+    else:
+        take &= ~match
+    return MergePlan(keep, take)
+
+
+def merged_key(key: str, added: list[str], rule: str) -> str:
+    raw = "|".join([key, *added, rule]).encode()
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def _update(built: dict, old: pd.DataFrame, p: MergePlan, new: pd.DataFrame) -> dict:
+    """Derived structures of the merged frame from the old ones plus the new rows."""
+    out = {}
+    if "index" in built:
+        out["index"] = built["index"].update(p.keep, new)
+    if "cube" in built:
+        out["cube"] = built["cube"].update(old[~p.keep], new)
+    if "groups" in built:
+        gm, add = built["groups"], GroupMatrix.build(new)
+        if gm is not None or add is not None:
+            gm = (gm or GroupMatrix.empty(len(old))).take(p.keep)
+            gm = gm.append(add or GroupMatrix.empty(len(new)))
+        out["groups"] = gm
+        if "minhash" in built and add is not None:
+            out["minhash"] = built["minhash"].take(p.keep).append(MinHashIndex.build(add))
+    return out
+
+
+def append(store: DatasetStore, key: str, frames: list[pd.DataFrame],
+           rule: str = "newest") -> DatasetHandle:
+    """Stored dataset ``key`` with ``frames`` appended in order, deduplicated by ``rule``.
+
+    The result is a new dataset (the old one stays shared as is). Its
+    filter index, cube and group matrix are updated from the new rows
+    when the old dataset has them built. ``df.attrs["merge"]`` holds the
+    row counts of the merge.
+    """
+    mkey = merged_key(key, [f.attrs["dataset_key"] for f in frames], rule)
+    handle = store.acquire(mkey)
+    if handle is not None:
+        return handle
+    old = store.get(key)
+    new = _concat([f.copy() for f in frames]) if len(frames) > 1 else frames[0]
+    p = plan(pd.Index(old[ID]), pd.Index(new[ID]), rule)
+    new = new[p.take].reset_index(drop=True)
+    derived = _update(store.built(key), old, p, new)
+    df = _concat([old.take(np.flatnonzero(p.keep)), new])
+    df.attrs["dataset_key"] = mkey
+    df.attrs["merge"] = p.stats()
+    df.attrs["skipped"] = list(dict.fromkeys(c for f in (old, *frames)
+                                             for c in f.attrs.get("skipped", [])))
+    return store.put(df, derived)
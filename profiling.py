@@ -0,0 +1,138 @@
+# profiling.py
+"""Опциональное профилирование этапов: время и пик памяти, трейс Chrome.
+
+Включается параметром ``?profile=1`` в адресе или переменной окружения
+SEGMENT_VIEWER_PROFILE=1. Выключенный профилировщик ничего не стоит:
+:func:`stage` без активного профиля — пустой контекст.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+ENV = "SEGMENT_VIEWER_PROFILE"
+HISTORY = 10  # profiled runs kept per session for the trace download
+
+_current: ContextVar[Profiler | None] = ContextVar("profiler", default=None)
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+_tracing_owned = False  # tracemalloc was started here, not by the host process
+
+
+def enabled(query_params=None) -> bool:
+    """``?profile=1`` (or any non-off value) or SEGMENT_VIEWER_PROFILE=1."""
+    flag = (query_params or {}).get("profile") or os.environ.get(ENV, "")
+    return str(flag).lower() not in ("", "0", "false", "no", "off")
+
+
+def _start_tracing() -> None:
+    global _tracing_users, _tracing_owned
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracing_owned = True
+        _tracing_users += 1
+
+
+def _stop_tracing() -> None:
+    global _tracing_users, _tracing_owned
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0 and _tracing_owned:
+            tracemalloc.stop()
+            _tracing_owned = False
+
+
+class Profiler:
+    """Nested stages of one script run.
+
+    Peak memory is the tracemalloc high-water mark above the stage's
+    starting allocation. tracemalloc is process-wide, so allocations of
+    concurrently running sessions are counted as well.
+    """
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started = time.time()
+        self.records: list[dict] = []
+        self._t0 = time.perf_counter()
+        self._depth = 0
+        self._stack: list[list[int]] = []  # [allocated at entry, highest peak seen]
+
+    @contextmanager
+    def stage(self, name: str):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            now, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1][1] = max(self._stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            self._stack.append([now, now])
+        rec = {"name": name, "depth": self._depth, "start": time.perf_counter() - self._t0}
+        self.records.append(rec)
+        self._depth += 1
+        try:
+            yield rec
+        finally:
+            self._depth -= 1
+            rec["seconds"] = time.perf_counter() - self._t0 - rec["start"]
+            if tracing:
+                entry, seen = self._stack.pop()
+                peak = max(seen, tracemalloc.get_traced_memory()[1])
+                rec["peak_mb"] = (peak - entry) / 2**20
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], peak)
+
+    @property
+    def total(self) -> float:
+        return sum(r.get("seconds", 0.0) for r in self.records if r["depth"] == 0)
+
+
+@contextmanager
+def activate(profiler: Profiler | None, history: list | None = None, memory: bool = True):
+    """Make ``profiler`` current for this run; appended to ``history`` on exit, even on rerun."""
+    if profiler is None:
+        yield None
+        return
+    token = _current.set(profiler)
+    if memory:
+        _start_tracing()
+    try:
+        with profiler.stage(profiler.label):
+            yield profiler
+    finally:
+        if memory:
+            _stop_tracing()
+        _current.reset(token)
+        if history is not None:
+            history.append(profiler)
+            del history[:-HISTORY]
+
+
+def current() -> Profiler | None:
+    return _current.get()
+
+
+def stage(name: str):
+    """Record ``name`` in the active profiler, if any."""
+    prof = _current.get()
+    return prof.stage(name) if prof is not None else nullcontext()
+
+
+def chrome_trace(runs: list[Profiler]) -> dict:
+    """Runs as a Chrome/Perfetto trace (chrome://tracing): one thread per run."""
+    events = []
+    for tid, prof in enumerate(runs, 1):
+        base = prof.started * 1e6
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid,
+                       "args": {"name": f"{tid}. {prof.label}"}})
+        for r in prof.records:
+            args = {"peak_mb": round(r["peak_mb"], 3)} if "peak_mb" in r else {}
+            events.append({"name": r["name"], "cat": "stage", "ph": "X", "pid": 1, "tid": tid,
+                           "ts": round(base + r["start"] * 1e6),
+                           "dur": round(r.get("seconds", 0.0) * 1e6), "args": args})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
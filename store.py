@@ -0,0 +1,261 @@
+# store.py
+"""Общий для всех сессий реестр датасетов с бюджетом памяти."""
+from __future__ import annotations
+
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable
+
+import pandas as pd
+
+from figcache import sizeof
+from ingest import CACHE_DIR, _store, cache_path, read_cache, sweep
+
+BUDGET_MB = float(os.environ.get("SEGMENT_VIEWER_STORE_MB", 2048))
+SAMPLE_ROWS = 10_000  # rows measured deeply when sizing object columns
+
+
+class DatasetGone(Exception):
+    """A dataset evicted from memory whose cache file has since been deleted."""
+
+
+def frame_bytes(df: pd.DataFrame) -> int:
+    """Resident size of ``df``; object columns are extrapolated from a sample."""
+    total = int(df.memory_usage(deep=False, index=True).sum())
+    obj = [c for c in df.columns if df[c].dtype == object]
+    if obj and len(df):
+        sample = df[obj].iloc[:SAMPLE_ROWS]
+        per_row = (sample.memory_usage(deep=True, index=False).sum()
+                   - sample.memory_usage(deep=False, index=False).sum()) / len(sample)
+        total += int(per_row * len(df))
+    return total
+
+
+@dataclass
+class _Entry:
+    path: Path
+    df: pd.DataFrame | None = None
+    nbytes: int = 0  # the frame plus its derived structures while resident
+    refs: int = 0
+    derived: dict = field(default_factory=dict)
+    building: dict[str, Future] = field(default_factory=dict)  # derived builds in progress
+    evicting: bool = False  # its cache file is being written
+    pinned: bool = False  # the cache file cannot be written: never evicted
+    lock: threading.Lock = field(default_factory=threading.Lock)  # one reload at a time
+
+
+class DatasetHandle:
+    """A session's reference to a stored dataset; released when garbage-collected.
+
+    Keep the handle (not the frame) in ``st.session_state`` so the store can
+    evict the frame between reruns.
+    """
+
+    def __init__(self, store: DatasetStore, key: str):
+        self.key = key
+        self._store = store
+        self._release = weakref.finalize(self, store._release, key)
+
+    @property
+    def df(self) -> pd.DataFrame:
+        return self._store.get(self.key)
+
+    def release(self) -> None:
+        self._release()
+
+
+class DatasetStore:
+    """Process-wide datasets keyed by content hash, shared read-only by sessions.
+
+    Resident frames and their derived structures (filter index, cube,
+    group matrix) count against ``budget`` bytes. Over budget, entries are
+    evicted least-recently-used first, those no session references before
+    the rest; an evicted frame is reloaded from its memory-mapped Parquet
+    cache file on the next access (:class:`DatasetGone` if that file has
+    been deleted meanwhile; the entry is dropped). Registering a new
+    dataset sweeps the cache directory, sparing the files of the
+    registered ones.
+
+    Slow work runs outside the store lock: derived structures are built
+    without blocking readers of the frame (callers wanting the same
+    structure wait for that build only), and eviction writes the cache
+    file before the entry is marked evicted.
+    """
+
+    def __init__(self, budget: int = int(BUDGET_MB * 2**20), cache_dir: Path = CACHE_DIR):
+        self.budget = budget
+        self.cache_dir = Path(cache_dir)
+        self.size = 0
+        self.evictions = self.reloads = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def acquire(self, key: str) -> DatasetHandle | None:
+        """Handle to a dataset already registered, without reading the upload again."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.refs += 1
+            self._entries.move_to_end(key)
+        return DatasetHandle(self, key)
+
+    def put(self, df: pd.DataFrame, derived: dict | None = None) -> DatasetHandle:
+        """Register a loaded frame (``df.attrs["dataset_key"]``); an equal one is reused.
+
+        ``derived`` seeds structures already built for ``df`` (see :meth:`derived`).
+        """
+        key = df.attrs["dataset_key"]
+        with self._lock:
+            new = key not in self._entries
+            entry = self._entries.setdefault(key, _Entry(cache_path(key, self.cache_dir)))
+            if entry.df is None:
+                self._admit(entry, df)
+                for name, value in (derived or {}).items():
+                    entry.derived[name] = value
+                    size = sizeof(value)
+                    entry.nbytes += size
+                    self.size += size
+            entry.refs += 1
+            self._entries.move_to_end(key)
+        self._evict(keep=key)
+        if new:
+            with self._lock:
+                keep = {e.path for e in self._entries.values()}
+            sweep(self.cache_dir, keep)
+        return DatasetHandle(self, key)
+
+    def get(self, key: str) -> pd.DataFrame:
+        with self._lock:
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            df = entry.df
+        if df is not None:
+            return df
+        with entry.lock:
+            df = entry.df
+            if df is None:
+                try:
+                    df = read_cache(key, self.cache_dir)
+                except FileNotFoundError:
+                    with self._lock:
+                        if self._entries.get(key) is entry:
+                            del self._entries[key]
+                    raise DatasetGone(key) from None
+                with self._lock:
+                    self.reloads += 1
+                    self._admit(entry, df)
+                reloaded = True
+            else:  # another caller reloaded it
+                reloaded = False
+        if reloaded:
+            self._evict(keep=key)
+        return df
+
+    def derived(self, key: str, name: str, build: Callable[[pd.DataFrame], Any]) -> Any:
+        """``build(df)`` computed once per resident dataset and evicted with it."""
+        if key not in self._entries:
+            raise KeyError(key)
+        df = self.get(key)
+        entry = self._entries[key]
+        with self._lock:
+            if name in entry.derived:
+                return entry.derived[name]
+            pending = entry.building.get(name)
+            if pending is None:
+                future = entry.building[name] = Future()
+        if pending is not None:
+            return pending.result()
+        try:
+            value = build(df)
+        except BaseException as e:
+            with self._lock:
+                del entry.building[name]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            del entry.building[name]
+            attach = entry.df is not None  # evicted meanwhile: nothing to attach it to
+            if attach:
+                entry.derived[name] = value
+                size = sizeof(value)
+                entry.nbytes += size
+                self.size += size
+        future.set_result(value)
+        if attach:
+            self._evict(keep=key)
+        return value
+
+    def built(self, key: str) -> dict:
+        """Derived structures currently resident for ``key``, without building any."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry.derived) if entry is not None else {}
+
+    def _admit(self, entry: _Entry, df: pd.DataFrame) -> None:
+        entry.df = df
+        entry.nbytes = frame_bytes(df)
+        self.size += entry.nbytes
+
+    def _evict(self, keep: str) -> None:
+        """Drop LRU frames until under budget; unreferenced entries go first.
+
+        A frame without a cache file is written to one first, outside the
+        store lock; it stays readable until the file is in place.
+        """
+        while True:
+            with self._lock:
+                if self.size <= self.budget:
+                    return
+                order = sorted(self._entries.items(), key=lambda kv: kv[1].refs > 0)  # stable: LRU kept
+                victim = next(((k, e) for k, e in order if k != keep and e.df is not None
+                               and not e.evicting and not e.pinned), None)
+                if victim is None:
+                    return
+                key, entry = victim
+                if entry.path.exists():
+                    self._drop(key, entry)
+                    continue
+                entry.evicting = True
+                df = entry.df
+            _store(df, entry.path)
+            with self._lock:
+                entry.evicting = False
+                if not entry.path.exists():  # mixed-type columns: cannot be reloaded
+                    entry.pinned = True
+                elif entry.df is df:
+                    self._drop(key, entry)
+
+    def _drop(self, key: str, entry: _Entry) -> None:
+        """Evict a resident frame whose cache file exists (store lock held)."""
+        self.size -= entry.nbytes
+        entry.df, entry.nbytes = None, 0
+        entry.derived.clear()
+        self.evictions += 1
+        if entry.refs == 0 and self._entries.get(key) is entry:
+            del self._entries[key]
+
+    def _release(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry.refs -= 1
+            if entry.refs == 0 and entry.df is None:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            resident = sum(e.df is not None for e in self._entries.values())
+            sessions = sum(e.refs for e in self._entries.values())
+        return {"datasets": len(self._entries), "resident": resident, "sessions": sessions,
+                "bytes": self.size, "budget": self.budget,
+                "evictions": self.evictions, "reloads": self.reloads}
@@ -16,38 +16,57 @@ st.markdown(
 )
 
 # 3) Imports after page config
-import pandas as pd
-from dashboard import run_dashboard
-
-# Column synonyms
-ALIASES = {
-    "segment": ["segment"],
-    "Тип аккаунта": ["Тип аккаунта"],
-    "Пол": ["Пол", "ПОЛ"],
-    "Лет": ["Лет", "Возраст", "ЛЕТ"],
-    "Устройство визита в VK": ["Устройство визита в VK", "УСТРОЙСТВО ВИЗИТА В ВК"],
-}
-
-@st.cache_data
+import time
+
+import profiling
+from dashboard import dataset_store, ingest_jobs, partial_overview, profile_panel, run_dashboard
+from ingest import content_key, load
+from jobs import POLL_SECONDS
+from merge import RULES, append
+from store import DatasetGone
+
+
+def _key(upload) -> str:
+    """Content hash of the upload, computed once per uploaded file in a session."""
+    file_id = getattr(upload, "file_id", None) or upload.name
+    cached = st.session_state.get("upload_key")
+    if cached is not None and cached[0] == file_id:
+        return cached[1]
+    with profiling.stage("hash"):
+        key = content_key(upload)
+    st.session_state.upload_key = (file_id, key)
+    return key
+
+
 def _read(upload):
-    """Read .csv or .xlsx into a DataFrame"""
-    if upload.name.lower().endswith(".csv"):
-        return pd.read_csv(upload)
-    return pd.read_excel(upload)
-
-
-def _canon(df: pd.DataFrame):
-    """Rename columns to canonical names and return missing list"""
-    missing = []
-    mapping = {}
-    for canon, vars in ALIASES.items():
-        for v in vars:
-            if v in df.columns:
-                mapping[v] = canon
-                break
-        else:
-            missing.append(canon)
-    return df.rename(columns=mapping), missing
+    """Shared-store handle of the upload, or the background job reading it: (handle, job)"""
+    key = _key(upload)
+    handle = dataset_store().acquire(key)  # another session already loaded this file
+    if handle is not None:
+        return handle, None
+    job = ingest_jobs().submit(key, upload, profile=profiling.current() is not None)
+    st.session_state.ingest_job = job
+    return None, job
+
+
+def _collect(job):
+    """Add a finished job's ingest profile to this session's trace history (once)."""
+    runs = st.session_state.setdefault("profile_runs", [])
+    if job.profiler is not None and job.profiler not in runs:
+        runs.append(job.profiler)
+        del runs[:-profiling.HISTORY]
+
+
+def _wait(job):
+    """Progress and a preliminary Обзор until the job finishes, then rerun."""
+    st.progress(job.fraction, text=f"Чтение файла… прочитано строк: {job.rows:,}".replace(",", " "))
+    view, counts = job.partial()
+    if view is not None:
+        with profiling.stage("partial"):
+            partial_overview(view, counts, job.rows, job.fraction)
+    if job.running:
+        time.sleep(POLL_SECONDS)
+    st.experimental_rerun()
 
 
 def _home():
@@ -59,29 +78,84 @@ def _home():
         "<p style='text-align:center;font-size:1.1rem;'>Загрузите выгрузку <b>ВКонтакте</b> – получите интерактивный дашборд.</p>",
         unsafe_allow_html=True,
     )
+    if st.session_state.pop("dataset_gone", False):
+        st.warning("Кеш файла удалён, данные нужно прочитать заново.")
     upload = st.file_uploader("Загрузите файл Excel/CSV", type=["xlsx", "csv"])
     if upload is None:
         st.info("📂 Пожалуйста, загрузите файл, чтобы продолжить…")
         return
     try:
-        df = _read(upload)
+        dataset, job = _read(upload)
     except Exception as e:
         st.error(f"Не удалось прочитать файл: {e}")
         return
-    st.success(f"Файл: {df.shape[0]} строк / {df.shape[1]} столбцов")
-    df, missing = _canon(df)
-    if missing:
-        st.error("Отсутствуют колонки: " + ", ".join(missing))
+    if dataset is None:
+        if not job.running:
+            _collect(job)
+        if job.state == "error":
+            st.error(f"Не удалось прочитать файл: {job.error}")
+        elif job.state == "missing":
+            st.error("Отсутствуют колонки: " + ", ".join(job.missing))
+        else:  # still reading, or done and in the store on the next run
+            _wait(job)
         return
-    st.session_state.df = df
+    if st.session_state.get("ingest_job") is not None:  # the job that read it finished
+        _collect(st.session_state.pop("ingest_job"))
+    df = dataset.df
+    st.success(f"Файл: {df.shape[0]} строк / {df.shape[1]} столбцов")
+    st.session_state.dataset = dataset
     st.experimental_rerun()
 
+def _append_panel():
+    """Sidebar form appending more exports to the open dataset, deduplicated by VK ID."""
+    with st.sidebar.expander("➕ Добавить выгрузки", expanded=False):
+        uploads = st.file_uploader("Файлы Excel/CSV", type=["xlsx", "csv"],
+                                   accept_multiple_files=True, key="append_files")
+        rule = st.radio("При совпадении VK ID", list(RULES), format_func=RULES.get,
+                        key="append_rule")
+        if uploads and st.button("Объединить", key="append_go"):
+            frames = []
+            for upload in uploads:
+                with st.spinner(f"Чтение {upload.name}…"), profiling.stage("read"):
+                    try:
+                        df, missing = load(upload)
+                    except Exception as e:
+                        st.error(f"Не удалось прочитать {upload.name}: {e}")
+                        return
+                if missing:
+                    st.error(f"{upload.name}: отсутствуют колонки: " + ", ".join(missing))
+                    return
+                frames.append(df)
+            with st.spinner("Объединение…"), profiling.stage("merge"):
+                st.session_state.dataset = append(dataset_store(), st.session_state.dataset.key,
+                                                  frames, rule)
+            st.experimental_rerun()
+        m = st.session_state.dataset.df.attrs.get("merge")
+        if m:
+            st.caption(f"Последнее объединение: добавлено {m['added']}, "
+                       f"заменено {m['removed']}, пропущено повторов {m['skipped']}")
+
+
 # Entry point
 def main():
-    if "df" not in st.session_state:
-        _home()
-    else:
-        run_dashboard(st.session_state.df)
+    prof = None
+    if profiling.enabled(st.query_params):
+        label = "dashboard" if "dataset" in st.session_state else "home"
+        prof = profiling.Profiler(label)
+    runs = st.session_state.setdefault("profile_runs", [])
+    with profiling.activate(prof, runs):
+        if "dataset" not in st.session_state:
+            _home()
+        else:
+            try:
+                _append_panel()
+                run_dashboard(st.session_state.dataset.df)
+            except DatasetGone:
+                del st.session_state.dataset
+                st.session_state.dataset_gone = True
+                st.experimental_rerun()
+    if prof is not None:
+        profile_panel(prof, runs)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,131 @@
+# synth.py
+"""Синтетические выгрузки VK заданного размера для бенчмарков.
+
+    python synth.py 1000000 -o benchmarks/data/audience_1m.csv [--groups 5]
+
+Колонки и их написание — как в реальных выгрузках; сегменты, города и
+группы распределены по Ципфу, у ботов длинный хвост подписок. Одинаковые
+(n, groups, seed) дают побайтно одинаковый файл.
+"""
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from export import XLSX_MAX_ROWS
+from ingest import ALIASES
+
+CHUNK_ROWS = 200_000
+N_SEGMENTS = 40
+N_CITIES = 800
+N_GROUPS = 20_000
+FIRST_NAMES = np.array(["Анна", "Мария", "Елена", "Ольга", "Дарья", "Иван", "Алексей",
+                        "Дмитрий", "Сергей", "Андрей", "Никита", "Екатерина"], dtype=object)
+LAST_NAMES = np.array(["Иванов", "Смирнова", "Кузнецов", "Попова", "Соколов", "Лебедева",
+                       "Козлов", "Новикова", "Морозов", "Волкова"], dtype=object)
+DEVICES = np.array(["vk.com", "m.vk.com", "Android app", "iPhone app"], dtype=object)
+
+
+def _zipf(k: int, s: float) -> np.ndarray:
+    p = 1.0 / np.arange(1, k + 1) ** s
+    return p / p.sum()
+
+
+def columns(groups: int = 5, aliased: bool = True) -> list[str]:
+    """Header in file order; ``aliased`` uses the export spelling (ПОЛ, ЛЕТ…)."""
+    name = (lambda c: ALIASES[c][-1]) if aliased else (lambda c: c)
+    return (["VK ID", "ИМЯ", "ФАМИЛИЯ", "РОДНОЙ ГОРОД", name("segment"), name("Тип аккаунта"),
+             name("Пол"), name("Лет"), name("Устройство визита в VK"), "group_count", "Ссылка"]
+            + [f"group_{j}_name" for j in range(groups)])
+
+
+def generate(n: int, groups: int = 5, seed: int = 0, aliased: bool = True,
+             chunk_rows: int = CHUNK_ROWS, blanks: float = 0.0) -> Iterator[pd.DataFrame]:
+    """Yield the export in chunks of ``chunk_rows``; VK IDs are unique overall.
+
+    ``blanks`` is the share of empty segment and account-type cells, as
+    real exports have; 0 leaves the output identical to earlier versions.
+    """
+    rng = np.random.default_rng(seed)
+    segments = np.array([f"Сегмент {i:02d}" for i in range(N_SEGMENTS)], dtype=object)
+    cities = np.array([f"город {i}" for i in range(N_CITIES)], dtype=object)
+    # Real exports pad some group names with spaces; GroupMatrix strips them
+    names = np.array([f" Группа {i}" if i % 7 == 0 else f"Группа {i}" for i in range(N_GROUPS)],
+                     dtype=object)
+    p_seg, p_city, p_group = _zipf(N_SEGMENTS, 1.1), _zipf(N_CITIES, 1.2), _zipf(N_GROUPS, 1.05)
+    header = columns(groups, aliased)
+    for start in range(0, n, chunk_rows):
+        m = min(chunk_rows, n - start)
+        bot = rng.random(m) < 0.15
+        age = np.clip(rng.normal(34, 13, m).round(), 14, 90)
+        age[rng.random(m) < 0.05] = np.nan
+        subs = np.where(bot, rng.lognormal(5.5, 1.2, m), rng.lognormal(3.5, 1.0, m)).astype(np.int64)
+        city = rng.choice(cities, m, p=p_city)
+        city[rng.random(m) < 0.2] = None
+        ids = 100_000 + start + rng.permutation(m)
+        data = [ids, rng.choice(FIRST_NAMES, m), rng.choice(LAST_NAMES, m), city,
+                rng.choice(segments, m, p=p_seg),
+                np.where(bot, "бот", "пользователь").astype(object),
+                rng.choice(np.array(["женский", "мужской"], dtype=object), m),
+                age, rng.choice(DEVICES, m, p=[0.2, 0.3, 0.35, 0.15]), subs,
+                np.char.add("https://vk.com/id", ids.astype(str)).astype(object)]
+        for j in range(groups):
+            col = rng.choice(names, m, p=p_group)
+            col[rng.random(m) < 0.1 + 0.15 * j] = None  # later group slots are sparser
+            data.append(col)
+        for k in (4, 5) if blanks else ():  # segment, Тип аккаунта
+            data[k] = data[k].copy()
+            data[k][rng.random(m) < blanks] = None
+        yield pd.DataFrame(dict(zip(header, data)))
+
+
+def write_csv(path, n: int, **kw) -> Path:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        for i, chunk in enumerate(generate(n, **kw)):
+            chunk.to_csv(f, header=i == 0, index=False)
+    return path
+
+
+def write_xlsx(path, n: int, **kw) -> Path:
+    """Stream rows through openpyxl's write-only mode; Excel's row limit applies."""
+    from openpyxl import Workbook
+
+    if n > XLSX_MAX_ROWS:
+        raise ValueError(f"Excel вмещает не более {XLSX_MAX_ROWS:,} строк".replace(",", " "))
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    for i, chunk in enumerate(generate(n, **kw)):
+        if i == 0:
+            ws.append(list(chunk.columns))
+        for row in chunk.astype(object).where(chunk.notna(), None).itertuples(index=False, name=None):
+            ws.append(row)
+    wb.save(path)
+    return path
+
+
+WRITERS = {".csv": write_csv, ".xlsx": write_xlsx}
+
+
+def main(argv=None) -> None:
+    ap = argparse.ArgumentParser(description="Синтетическая выгрузка VK")
+    ap.add_argument("rows", type=int)
+    ap.add_argument("-o", "--out", type=Path, required=True, help=".csv или .xlsx")
+    ap.add_argument("--groups", type=int, default=5, help="число колонок group_*_name")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--blanks", type=float, default=0.0,
+                    help="доля пустых ячеек segment и «Тип аккаунта»")
+    args = ap.parse_args(argv)
+    WRITERS[args.out.suffix.lower()](args.out, args.rows, groups=args.groups, seed=args.seed,
+                                     blanks=args.blanks)
+
+
+if __name__ == "__main__":
+    main()